@@ -0,0 +1,115 @@
+import gzip
+import hashlib
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('portal.asset_cache')
+
+class CachedAsset:
+    """Archivo estático cargado en memoria con cabeceras precalculadas (y su variante gzip si se pide)"""
+
+    def __init__(self, path, content_type, cache_control, mtime, body):
+        self.path = path
+        self.content_type = content_type
+        self.mtime = mtime
+        self.body = body
+        self.text = body.decode('utf-8')
+
+        digest = hashlib.sha1(body).hexdigest()[:16]
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gz"'
+
+        self.common_headers = (f"Content-Type: {content_type}\r\nCache-Control: {cache_control}\r\n"
+                               "Vary: Accept-Encoding\r\n")
+        self.head = (
+            "HTTP/1.1 200 OK\r\n" + self.common_headers +
+            f"ETag: {self.etag}\r\nContent-Length: {len(self.body)}\r\n"
+        ).encode()
+        # Las páginas HTML sólo se usan como plantilla: la variante gzip se construye con la
+        # primera respuesta que la necesita, no al cargar cada archivo
+        self.gzip_head = None
+        self.gzip_body = None
+        self.not_modified_head = (
+            "HTTP/1.1 304 Not Modified\r\n"
+            f"Cache-Control: {cache_control}\r\nVary: Accept-Encoding\r\n"
+        ).encode()
+
+    def gzip_variant(self):
+        """Cabeceras y cuerpo comprimidos, calculados una sola vez"""
+        if self.gzip_body is None:
+            body = gzip.compress(self.body, compresslevel=9, mtime=0)
+            self.gzip_head = (
+                "HTTP/1.1 200 OK\r\n" + self.common_headers +
+                f"ETag: {self.gzip_etag}\r\nContent-Encoding: gzip\r\nContent-Length: {len(body)}\r\n"
+            ).encode()
+            # El cuerpo se publica el último: quien lo vea ya tiene sus cabeceras
+            self.gzip_body = body
+        return self.gzip_head, self.gzip_body
+
+    def match_etag(self, if_none_match):
+        """Devuelve el ETag enviado por el cliente si corresponde a este contenido"""
+        if not if_none_match:
+            return None
+        if if_none_match.strip() == '*':
+            return self.etag
+        for tag in if_none_match.split(','):
+            tag = tag.strip().removeprefix('W/')
+            if tag in (self.etag, self.gzip_etag):
+                return tag
+        return None
+
+class AssetCache:
+    """Mantiene en memoria los archivos estáticos y los recarga si cambia su mtime"""
+
+    def __init__(self, base_dir, check_interval=1.0):
+        self.base_dir = base_dir
+        self.check_interval = check_interval  # Segundos entre comprobaciones de mtime
+        self.assets = {}  # {filename: CachedAsset}
+        self.last_check = {}  # {filename: timestamp de la última comprobación}
+        self.lock = threading.Lock()
+
+    def get(self, filename, content_type='text/html; charset=utf-8', cache_control='no-store'):
+        """Obtiene un archivo de la caché, cargándolo o recargándolo si hace falta"""
+        asset = self.assets.get(filename)
+        now = time.monotonic()
+        if asset is not None and now - self.last_check.get(filename, 0) < self.check_interval:
+            return asset
+
+        path = os.path.join(self.base_dir, filename)
+        mtime = os.stat(path).st_mtime_ns
+        self.last_check[filename] = now
+        if asset is not None and asset.mtime == mtime:
+            return asset
+
+        with self.lock:
+            asset = self.assets.get(filename)
+            if asset is None or asset.mtime != mtime:
+                with open(path, 'rb') as f:
+                    body = f.read()
+                asset = CachedAsset(path, content_type, cache_control, mtime, body)
+                self.assets[filename] = asset
+                logger.info("📦 AssetCache: %s cargado (%d B)", filename, len(asset.body))
+            return asset
+
+    def response(self, filename, content_type, headers, connection, cache_control='public, max-age=3600'):
+        """Construye la respuesta HTTP (200, 200 gzip o 304) para un archivo estático"""
+        asset = self.get(filename, content_type, cache_control)
+
+        etag = asset.match_etag(headers.get('if-none-match'))
+        if etag:
+            return asset.not_modified_head + f"ETag: {etag}\r\n{connection}\r\n".encode()
+
+        if accepts_gzip(headers.get('accept-encoding', '')):
+            gzip_head, gzip_body = asset.gzip_variant()
+            return gzip_head + connection.encode() + b"\r\n" + gzip_body
+        return asset.head + connection.encode() + b"\r\n" + asset.body
+
+def accepts_gzip(accept_encoding):
+    """Indica si el cliente acepta respuestas comprimidas con gzip"""
+    for coding in accept_encoding.lower().split(','):
+        name, _, params = coding.strip().partition(';')
+        if name.strip() in ('gzip', '*'):
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
@@ -1,98 +1,265 @@
+import logging
 import sqlite3
-import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from password_hasher import PasswordHasher, HasherBusyError
+from metrics import REGISTRY
+from tracing import TRACER
+
+logger = logging.getLogger('portal.auth_manager')
+
+SQLITE_SECONDS = REGISTRY.histogram('portal_sqlite_query_seconds',
+                                    'Duración de las consultas SQLite por método de AuthManager', ['method'])
+
+# Columnas que un cambio parcial de sesión puede actualizar por IP
+SESSION_PATCH_COLUMNS = ('mac_address', 'liberated')
+
+def migrate_usuarios(cursor):
+    """Versión 1: tabla de usuarios (las bases anteriores pueden no tener mac_address)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            ip_address TEXT,
+            mac_address TEXT DEFAULT '00:00:00:00:00:00',
+            session_start TIMESTAMP DEFAULT NULL,
+            session_expire TIMESTAMP DEFAULT NULL,
+            liberated INTEGER DEFAULT 0,
+            login_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    columns = [col[1] for col in cursor.execute("PRAGMA table_info(usuarios)").fetchall()]
+    if 'mac_address' not in columns:
+        cursor.execute("ALTER TABLE usuarios ADD COLUMN mac_address TEXT DEFAULT '00:00:00:00:00:00'")
+
+def migrate_sessions(cursor):
+    """Versión 2: sesiones en su propia tabla con clave IP (varias por usuario)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            ip_address TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            mac_address TEXT DEFAULT '00:00:00:00:00:00',
+            session_start TIMESTAMP DEFAULT NULL,
+            session_expire TIMESTAMP DEFAULT NULL,
+            liberated INTEGER DEFAULT 0
+        )
+    ''')
+    # Barridos de expiración y restauración al arrancar: rango sobre (liberated, session_expire)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_live ON sessions(liberated, session_expire)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_mac ON sessions(mac_address)')
+    
+    # Copiar la última sesión conocida de cada IP; las columnas antiguas de usuarios dejan de usarse
+    cursor.execute('''
+        INSERT OR REPLACE INTO sessions
+            (ip_address, username, mac_address, session_start, session_expire, liberated)
+        SELECT ip_address, username, mac_address, session_start, session_expire, liberated
+        FROM usuarios WHERE ip_address IS NOT NULL
+        ORDER BY session_start IS NOT NULL, session_start
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_ip')
+    cursor.execute('DROP INDEX IF EXISTS idx_mac')
+
+# Una fila por IP: iniciar sesión reemplaza la sesión anterior de esa IP
+SAVE_SESSION_SQL = """INSERT OR REPLACE INTO sessions
+    (ip_address, username, mac_address, session_start, session_expire, liberated)
+    VALUES (?, ?, ?, ?, ?, ?)"""
+
+# Migraciones en orden: la posición + 1 es el PRAGMA user_version que dejan aplicado
+MIGRATIONS = [migrate_usuarios, migrate_sessions]
 
 class AuthManager:
     """Maneja autenticación y registro de usuarios"""
     
-    def __init__(self, db_path='usuarios.db'):
+    def __init__(self, db_path='usuarios.db', busy_timeout=5.0, hasher=None):
         self.db_path = db_path
+        self.hasher = hasher or PasswordHasher()
+        self.busy_timeout = busy_timeout  # Segundos esperando a que se libere un lock de escritura
+        self.local = threading.local()  # Una conexión persistente por hilo
+        self.connections = []
+        self.connections_lock = threading.Lock()
+        self.query_stats = {}  # {método: [llamadas, segundos totales, máximo]}
+        self.stats_lock = threading.Lock()
         self.init_db()
     
+    def get_connection(self):
+        """Obtiene la conexión del hilo actual, creándola la primera vez"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            # cached_statements: las sentencias preparadas se reutilizan mientras viva la conexión
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout,
+                                   cached_statements=256, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout * 1000)}')
+            self.local.conn = conn
+            with self.connections_lock:
+                self.connections.append(conn)
+        return conn
+    
+    @contextmanager
+    def query(self, name):
+        """Ejecuta un bloque con la conexión del hilo, confirma la transacción y mide la latencia"""
+        conn = self.get_connection()
+        start = time.perf_counter()
+        try:
+            yield conn.cursor()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.record_latency(name, elapsed)
+            TRACER.add_span(f"sqlite.{name}", start, elapsed)
+    
+    def record_latency(self, name, elapsed):
+        """Acumula la latencia de una consulta"""
+        SQLITE_SECONDS.observe(elapsed, name)
+        with self.stats_lock:
+            stats = self.query_stats.get(name)
+            if stats is None:
+                self.query_stats[name] = [1, elapsed, elapsed]
+            else:
+                stats[0] += 1
+                stats[1] += elapsed
+                if elapsed > stats[2]:
+                    stats[2] = elapsed
+    
+    def get_query_stats(self):
+        """Obtiene llamadas, latencia media y máxima (ms) por método"""
+        with self.stats_lock:
+            return {
+                name: {
+                    'count': count,
+                    'avg_ms': total / count * 1000,
+                    'max_ms': maximum * 1000
+                }
+                for name, (count, total, maximum) in self.query_stats.items()
+            }
+    
+    def close(self):
+        """Cierra todas las conexiones abiertas"""
+        with self.connections_lock:
+            for conn in self.connections:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self.connections.clear()
+        self.local = threading.local()
+        self.hasher.close()
+    
     def init_db(self):
-        """Inicializa la base de datos con estructura necesaria"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS usuarios (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                ip_address TEXT,
-                mac_address TEXT DEFAULT '00:00:00:00:00:00',
-                session_start TIMESTAMP DEFAULT NULL,
-                session_expire TIMESTAMP DEFAULT NULL,
-                liberated INTEGER DEFAULT 0,
-                login_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        """Inicializa la base de datos y aplica las migraciones pendientes"""
+        test_password = self.hash_password('test')
+        with self.query('init_db') as cursor:
+            version = cursor.execute('PRAGMA user_version').fetchone()[0]
+            for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                migration(cursor)
+                # PRAGMA no admite parámetros; target es un entero de la lista de migraciones
+                cursor.execute(f'PRAGMA user_version = {target}')
+                logger.info("🗄️ AuthManager: Esquema migrado a la versión %d", target)
+            
+            cursor.execute(
+                "INSERT OR IGNORE INTO usuarios (username, password) VALUES (?, ?)",
+                ('test', test_password)
             )
-        ''')
-        
-        # Asegurar que la columna mac_address existe
-        try:
-            cursor.execute("ALTER TABLE usuarios ADD COLUMN mac_address TEXT DEFAULT '00:00:00:00:00:00'")
-        except sqlite3.OperationalError:
-            pass
-        
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ip ON usuarios(ip_address)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_mac ON usuarios(mac_address)')
-        
-        cursor.execute(
-            "INSERT OR IGNORE INTO usuarios (username, password) VALUES (?, ?)",
-            ('test', self.hash_password('test'))
-        )
-        
-        conn.commit()
-        conn.close()
-        print("✅ AuthManager: Base de datos inicializada")
+        logger.info("✅ AuthManager: Base de datos inicializada")
     
     def hash_password(self, password):
-        """Hashea una contraseña usando SHA256"""
-        return hashlib.sha256(password.encode()).hexdigest()
+        """Hashea una contraseña con scrypt y sal aleatoria (en el pool del hasher)"""
+        return self.hasher.hash(password)
     
     def register_user(self, username, password):
         """Registra un nuevo usuario"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO usuarios (username, password) VALUES (?, ?)",
-                (username, self.hash_password(password))
-            )
-            conn.commit()
-            conn.close()
+            password_hash = self.hash_password(password)
+            with self.query('register_user') as cursor:
+                cursor.execute(
+                    "INSERT INTO usuarios (username, password) VALUES (?, ?)",
+                    (username, password_hash)
+                )
             return True
         except sqlite3.IntegrityError:
             return False  # Usuario ya existe
+        except HasherBusyError as e:
+            logger.warning("⚠️ AuthManager: Registro rechazado por carga: %s", e)
+            return False
         except Exception as e:
-            print(f"❌ AuthManager Error registrando usuario: {e}")
+            logger.error("❌ AuthManager Error registrando usuario: %s", e)
             return False
     
+    def existing_usernames(self, usernames):
+        """Obtiene cuáles de los usernames indicados ya están registrados"""
+        found = set()
+        usernames = list(usernames)
+        with self.query('existing_usernames') as cursor:
+            # Bloques por debajo del límite de parámetros de SQLite
+            for i in range(0, len(usernames), 500):
+                chunk = usernames[i:i + 500]
+                placeholders = ', '.join('?' * len(chunk))
+                cursor.execute(f"SELECT username FROM usuarios WHERE username IN ({placeholders})", chunk)
+                found.update(row[0] for row in cursor.fetchall())
+        return found
+
+    def insert_users(self, users):
+        """Inserta [(username, hash)] en una sola transacción; devuelve cuántos se insertaron"""
+        with self.query('insert_users') as cursor:
+            # OR IGNORE: un username registrado entre tanto cuenta como duplicado, no aborta el lote
+            cursor.executemany("INSERT OR IGNORE INTO usuarios (username, password) VALUES (?, ?)", users)
+            return cursor.rowcount
+
     def verify_login(self, username, password):
         """Verifica credenciales de login"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT password FROM usuarios WHERE username = ?", 
-                (username,)
-            )
-            resultado = cursor.fetchone()
-            conn.close()
-            return resultado and resultado[0] == self.hash_password(password)
+            with self.query('verify_login') as cursor:
+                cursor.execute(
+                    "SELECT password FROM usuarios WHERE username = ?", 
+                    (username,)
+                )
+                resultado = cursor.fetchone()
+            if not resultado:
+                # Misma derivación por el mismo pool: el tiempo de respuesta no revela si existe
+                return self.hasher.verify_dummy(password)
+            
+            valid, needs_rehash = self.hasher.verify(password, resultado[0])
+            if valid and needs_rehash:
+                self.rehash_password(username, password, resultado[0])
+            return valid
+        except HasherBusyError as e:
+            logger.warning("⚠️ AuthManager: Login rechazado por carga: %s", e)
+            return False
         except Exception as e:
-            print(f"❌ AuthManager Error en verify_login: {e}")
+            logger.error("❌ AuthManager Error en verify_login: %s", e)
             return False
     
+    def rehash_password(self, username, password, old_hash):
+        """Migra un hash antiguo (SHA256 o coste distinto) tras un login correcto"""
+        try:
+            new_hash = self.hash_password(password)
+            with self.query('rehash_password') as cursor:
+                # Sólo si nadie cambió la contraseña mientras tanto
+                cursor.execute(
+                    "UPDATE usuarios SET password = ? WHERE username = ? AND password = ?",
+                    (new_hash, username, old_hash)
+                )
+            logger.info("🔁 AuthManager: Contraseña de %s migrada a scrypt", username)
+        except Exception as e:
+            logger.error("❌ AuthManager Error migrando contraseña: %s", e)
+    
     def get_username_by_ip(self, ip):
         """Obtiene username por IP"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT username FROM usuarios WHERE ip_address = ?",
-                (ip,)
-            )
-            result = cursor.fetchone()
-            conn.close()
+            with self.query('get_username_by_ip') as cursor:
+                cursor.execute(
+                    "SELECT username FROM sessions WHERE ip_address = ?",
+                    (ip,)
+                )
+                result = cursor.fetchone()
             return result[0] if result else None
         except:
             return None
@@ -100,93 +267,123 @@ class AuthManager:
     def update_session_data(self, client_ip, username, mac, session_start, session_expire, liberated=1):
         """Actualiza datos de sesión en la BD"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                """UPDATE usuarios SET 
-                   ip_address = ?, 
-                   mac_address = ?,
-                   session_start = ?, 
-                   session_expire = ?, 
-                   liberated = ? 
-                   WHERE username = ?""",
-                (client_ip, mac, session_start, session_expire, liberated, username)
-            )
-            conn.commit()
-            conn.close()
+            with self.query('update_session_data') as cursor:
+                cursor.execute(SAVE_SESSION_SQL,
+                               (client_ip, username, mac, session_start, session_expire, liberated))
             return True
         except Exception as e:
-            print(f"❌ AuthManager Error actualizando sesión: {e}")
+            logger.error("❌ AuthManager Error actualizando sesión: %s", e)
             return False
     
     def update_mac_address(self, client_ip, mac):
         """Actualiza la dirección MAC en la BD"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE usuarios SET mac_address = ? WHERE ip_address = ?",
-                (mac, client_ip)
-            )
-            conn.commit()
-            conn.close()
+            with self.query('update_mac_address') as cursor:
+                cursor.execute(
+                    "UPDATE sessions SET mac_address = ? WHERE ip_address = ?",
+                    (mac, client_ip)
+                )
             return True
         except Exception as e:
-            print(f"❌ AuthManager Error actualizando MAC: {e}")
+            logger.error("❌ AuthManager Error actualizando MAC: %s", e)
             return False
     
+    def apply_session_changes(self, changes):
+        """Aplica en una sola transacción una lista de cambios de sesión [(ip, tipo, {columna: valor})]"""
+        try:
+            with self.query('apply_session_changes') as cursor:
+                for client_ip, kind, values in changes:
+                    if kind == 'session':
+                        cursor.execute(SAVE_SESSION_SQL, (
+                            client_ip, values['username'], values['mac_address'],
+                            values['session_start'], values['session_expire'], values['liberated']
+                        ))
+                    else:
+                        columns = [column for column in SESSION_PATCH_COLUMNS if column in values]
+                        assignments = ', '.join(f"{column} = ?" for column in columns)
+                        cursor.execute(
+                            f"UPDATE sessions SET {assignments} WHERE ip_address = ?",
+                            [values[column] for column in columns] + [client_ip]
+                        )
+            return True
+        except Exception as e:
+            logger.error("❌ AuthManager Error aplicando cambios de sesión: %s", e)
+            return False
+
     def get_session_data(self, client_ip):
         """Obtiene datos de sesión por IP"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT username, session_expire, mac_address FROM usuarios WHERE ip_address = ? AND liberated = 1",
-                (client_ip,)
-            )
-            result = cursor.fetchone()
-            conn.close()
+            with self.query('get_session_data') as cursor:
+                cursor.execute(
+                    "SELECT username, session_expire, mac_address FROM sessions WHERE ip_address = ? AND liberated = 1",
+                    (client_ip,)
+                )
+                result = cursor.fetchone()
             return result
         except Exception as e:
-            print(f"❌ AuthManager Error obteniendo sesión: {e}")
+            logger.error("❌ AuthManager Error obteniendo sesión: %s", e)
             return None
     
+    def get_live_sessions(self):
+        """Obtiene en una sola consulta todas las sesiones liberadas y no expiradas"""
+        try:
+            with self.query('get_live_sessions') as cursor:
+                # session_expire se guarda con isoformat() en hora local; rango sobre idx_sessions_live
+                cursor.execute(
+                    """SELECT ip_address, username, session_expire, mac_address FROM sessions
+                       WHERE liberated = 1 AND session_expire > ?
+                       ORDER BY session_expire""",
+                    (datetime.now().isoformat(),)
+                )
+                return cursor.fetchall()
+        except Exception as e:
+            logger.error("❌ AuthManager Error obteniendo sesiones vigentes: %s", e)
+            return []
+    
+    def count_live_sessions(self):
+        """Cuenta las sesiones liberadas y no expiradas (rango sobre idx_sessions_live)"""
+        try:
+            with self.query('count_live_sessions') as cursor:
+                cursor.execute(
+                    "SELECT COUNT(*) FROM sessions WHERE liberated = 1 AND session_expire > ?",
+                    (datetime.now().isoformat(),)
+                )
+                return cursor.fetchone()[0]
+        except Exception as e:
+            logger.error("❌ AuthManager Error contando sesiones: %s", e)
+            return 0
+    
+    def data_version(self):
+        """Cambia cada vez que otra conexión (u otro proceso) confirma cambios en la BD"""
+        return self.get_connection().execute('PRAGMA data_version').fetchone()[0]
+    
     def set_liberated(self, client_ip, liberated):
         """Actualiza estado de liberación"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE usuarios SET liberated = ? WHERE ip_address = ?",
-                (liberated, client_ip)
-            )
-            conn.commit()
-            conn.close()
+            with self.query('set_liberated') as cursor:
+                cursor.execute(
+                    "UPDATE sessions SET liberated = ? WHERE ip_address = ?",
+                    (liberated, client_ip)
+                )
             return True
         except Exception as e:
-            print(f"❌ AuthManager Error actualizando estado: {e}")
+            logger.error("❌ AuthManager Error actualizando estado: %s", e)
             return False
     
     def clean_expired_sessions(self):
-        """Limpia sesiones expiradas"""
+        """Limpia sesiones expiradas (rango sobre idx_sessions_live, sin recorrer la tabla)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("PRAGMA table_info(usuarios)")
-            columns = [col[1] for col in cursor.fetchall()]
-            
-            if 'session_expire' in columns:
+            with self.query('clean_expired_sessions') as cursor:
+                # Mismo formato que update_session_data (isoformat en hora local)
                 cursor.execute(
-                    "UPDATE usuarios SET liberated = 0 WHERE session_expire < datetime('now')"
+                    "UPDATE sessions SET liberated = 0 WHERE liberated = 1 AND session_expire < ?",
+                    (datetime.now().isoformat(),)
                 )
                 count = cursor.rowcount
-            else:
-                cursor.execute("UPDATE usuarios SET liberated = 0")
-                count = cursor.rowcount
                 
-            conn.commit()
-            conn.close()
-            print(f"🧹 AuthManager: Limpiadas {count} sesiones expiradas")
+            if count:
+                logger.info("🧹 AuthManager: Limpiadas %d sesiones expiradas", count)
+            return count
         except Exception as e:
-            print(f"❌ AuthManager Error limpiando sesiones: {e}")
\ No newline at end of file
+            logger.error("❌ AuthManager Error limpiando sesiones: %s", e)
+            return 0
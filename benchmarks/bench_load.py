@@ -0,0 +1,288 @@
+"""Prueba de carga por loopback: cientos de clientes del hotspot contra un HotspotServer real
+
+El servidor corre en un proceso aparte con firewall y tabla de vecinos falsos (sin root),
+y cada cliente virtual sale de su propia IP 127.0.x.y recorriendo el flujo de un móvil:
+detección del portal, portal, styles.css, registro, login, refrescos de /status y logout
+o abandono. El servidor usa sesiones cortas (--session-timeout) y la prueba espera a que
+caduquen las abandonadas, así que el camino de expiración también se ejecuta. Informa de
+throughput, p50/p95/p99 y errores por ruta, del pico de hilos y memoria del servidor y de las
+sesiones que siguen activas al final.
+
+Uso: python3 benchmarks/bench_load.py --clients 200 --mode event-loop [--json resultado.json]
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_session_contention import FakeNeighborSource, percentile
+
+ROUTES = ('probe', 'portal', 'styles.css', 'register', 'login', 'status', 'logout')
+
+def client_ips(count):
+    """IPs de loopback de los clientes (127.0.0.1 queda para el gateway y /metrics)"""
+    return [f"127.0.{1 + i // 250}.{i % 250 + 1}" for i in range(count)]
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def serve(args):
+    """Proceso hijo: HotspotServer en loopback con backends falsos"""
+    from firewall_manager import RecordingRunner
+    from neighbor_table import NeighborTable
+    from server import HotspotServer
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # Cada operación de firewall cuesta lo que crear un proceso, aunque no se ejecute nada
+    server = HotspotServer(host='127.0.0.1', port=args.port, mode=args.mode, workers=args.workers,
+                           pool_size=args.pool_size, hash_workers=args.hash_workers,
+                           session_timeout=args.session_timeout,
+                           firewall_runner=RecordingRunner(delay=0.005),
+                           neighbor_table=NeighborTable(FakeNeighborSource(client_ips(args.clients))))
+    server.start()
+
+class VirtualClient:
+    """Un móvil del hotspot: conexión keep-alive desde su IP, como un navegador"""
+
+    def __init__(self, index, ip, port, results, lock):
+        self.index = index
+        self.ip = ip
+        self.port = port
+        self.results = results  # {ruta: [latencias]}
+        self.requests = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.lock = lock
+        self.conn = None
+        self.abandoned_at = None  # Instante en que se fue sin logout
+
+    def request(self, route, method, path, body=None, expect=None):
+        """Envía una solicitud y registra latencia o error; reintenta una vez si el servidor cerró la conexión"""
+        self.requests[route] += 1
+        headers = {'Host': '127.0.0.1'}
+        if body is not None:
+            body = body.encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        for attempt in (0, 1):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30,
+                                                       source_address=(self.ip, 0))
+            start = time.perf_counter()
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                content = response.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # Keep-alive cerrado por el servidor mientras el cliente "pensaba"
+                self.close()
+                if attempt == 0:
+                    continue
+                self.errors[route] += 1
+                return False
+            except OSError:
+                self.close()
+                self.errors[route] += 1
+                return False
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.results[route].append(elapsed)
+            if response.will_close:
+                self.close()
+            if response.status != 200 or (expect is not None and expect not in content):
+                self.errors[route] += 1
+                return False
+            return True
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def run(self, refreshes, think_time, abandon_rate):
+        username = f"carga{self.index}"
+        form = f"username={username}&password=clave-{self.index}"
+        try:
+            # Android/iOS detectan el portal pidiendo una URL conocida
+            self.request('probe', 'GET', '/generate_204', expect=b'<form')
+            self.request('portal', 'GET', '/', expect=b'<form')
+            self.request('styles.css', 'GET', '/styles.css')
+            self.request('register', 'POST', '/register', form, expect=b'alert success')
+            if not self.request('login', 'POST', '/login', form, expect=self.ip.encode()):
+                return
+            for _ in range(refreshes):
+                time.sleep(think_time * random.uniform(0.5, 1.5))
+                self.request('status', 'GET', '/status', expect=self.ip.encode())
+            if random.random() >= abandon_rate:
+                self.request('logout', 'GET', '/logout', expect='Sesión cerrada'.encode())
+            else:
+                self.abandoned_at = time.monotonic()
+        finally:
+            self.close()
+
+def read_proc_status(pid):
+    """Hilos, RSS y pico de RSS (KiB) del proceso servidor según /proc"""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in ('Threads', 'VmRSS', 'VmHWM'):
+                    values[name] = int(value.split()[0])
+    except OSError:
+        pass
+    return values
+
+def active_sessions(port):
+    """portal_active_sessions según /metrics (sólo responde a 127.0.0.1), o None"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        conn.request('GET', '/metrics', headers={'Host': '127.0.0.1'})
+        for line in conn.getresponse().read().decode().splitlines():
+            if line.startswith('portal_active_sessions '):
+                return int(float(line.split()[1]))
+    except OSError:
+        pass
+    finally:
+        conn.close()
+    return None
+
+def wait_for_port(port, process, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"El servidor terminó con código {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("El servidor no empezó a escuchar a tiempo")
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del portal por loopback")
+    parser.add_argument('--clients', type=int, default=200, help="Clientes virtuales")
+    parser.add_argument('--ramp', type=float, default=5.0, help="Segundos en los que llegan todos los clientes")
+    parser.add_argument('--refreshes', type=int, default=5, help="Refrescos de /status por cliente")
+    parser.add_argument('--think-time', type=float, default=1.0, help="Segundos medios entre refrescos")
+    parser.add_argument('--abandon-rate', type=float, default=0.2,
+                        help="Fracción de clientes que se van sin logout (la sesión caduca)")
+    parser.add_argument('--session-timeout', type=float, default=0,
+                        help="Segundos de sesión en el servidor (0 = lo justo para los refrescos + 5 s)")
+    parser.add_argument('--mode', choices=['threaded', 'event-loop'], default='threaded')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--pool-size', type=int, default=32)
+    parser.add_argument('--hash-workers', type=int, default=2)
+    parser.add_argument('--json', metavar='FICHERO', help="Escribe también los resultados en JSON")
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    # Las sesiones deben durar todos los refrescos (hasta 1.5 think-time cada uno) y caducar pronto
+    session_timeout = args.session_timeout or args.refreshes * args.think_time * 1.5 + 5
+    port = free_port()
+    command = [sys.executable, os.path.abspath(__file__), '--serve', '--port', str(port),
+               '--mode', args.mode, '--workers', str(args.workers), '--pool-size', str(args.pool_size),
+               '--hash-workers', str(args.hash_workers), '--clients', str(args.clients),
+               '--session-timeout', str(session_timeout)]
+    # La BD del servidor (usuarios.db) se crea en un directorio temporal que se borra al terminar
+    with tempfile.TemporaryDirectory() as tmp:
+        server = subprocess.Popen(command, cwd=tmp, stdout=subprocess.DEVNULL)
+        try:
+            wait_for_port(port, server)
+
+            peak = {'Threads': 0, 'VmRSS': 0, 'VmHWM': 0}
+            stop = threading.Event()
+
+            def monitor():
+                while not stop.is_set():
+                    for name, value in read_proc_status(server.pid).items():
+                        peak[name] = max(peak[name], value)
+                    time.sleep(0.1)
+
+            results = defaultdict(list)
+            lock = threading.Lock()
+            clients = [VirtualClient(i, ip, port, results, lock) for i, ip in enumerate(client_ips(args.clients))]
+            threads = [threading.Thread(target=client.run, args=(args.refreshes, args.think_time, args.abandon_rate),
+                                        daemon=True) for client in clients]
+
+            monitor_thread = threading.Thread(target=monitor, daemon=True)
+            monitor_thread.start()
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+                time.sleep(args.ramp / max(len(threads), 1))
+            for thread in threads:
+                thread.join()
+            duration = time.perf_counter() - start
+
+            # Las sesiones abandonadas caducan en el servidor: se espera a que pase su timeout
+            abandoned = [client.abandoned_at for client in clients if client.abandoned_at is not None]
+            if abandoned:
+                wait = max(abandoned) + session_timeout + 2 - time.monotonic()
+                print(f"⏳ Esperando {max(wait, 0):.0f} s a que caduquen {len(abandoned)} sesiones abandonadas")
+                time.sleep(max(wait, 0))
+            sessions_left = active_sessions(port)
+            stop.set()
+            monitor_thread.join()
+        finally:
+            server.terminate()
+            server.wait(timeout=15)
+
+    requests = defaultdict(int)
+    errors = defaultdict(int)
+    for client in clients:
+        for route, count in client.requests.items():
+            requests[route] += count
+        for route, count in client.errors.items():
+            errors[route] += count
+
+    report = {'clients': args.clients, 'mode': args.mode, 'duration': round(duration, 3), 'routes': {},
+              'peak_threads': peak['Threads'], 'peak_rss_kib': max(peak['VmRSS'], peak['VmHWM']),
+              'session_timeout': session_timeout, 'sessions_left': sessions_left}
+    total = 0
+    print(f"⏱️  {args.clients} clientes, modo {args.mode}, {duration:.1f} s")
+    print(f"   {'ruta':<11} {'solicitudes':>11} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errores':>8}")
+    for route in ROUTES:
+        samples = results.get(route, [])
+        failed = errors.get(route, 0)
+        total += len(samples)
+        stats = {
+            'requests': len(samples),
+            'rps': round(len(samples) / duration, 2),
+            'p50_ms': round(percentile(samples, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(samples, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+            'errors': failed,
+            'error_rate': round(failed / max(requests.get(route, 0), 1), 4),
+        }
+        report['routes'][route] = stats
+        print(f"   {route:<11} {stats['requests']:>11} {stats['rps']:>8.1f} {stats['p50_ms']:>8.1f} "
+              f"{stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f} {failed:>8} ({stats['error_rate']:.1%})")
+    report['rps'] = round(total / duration, 2)
+    print(f"   total: {total / duration:.1f} req/s")
+    print(f"   servidor: pico de {report['peak_threads']} hilos, {report['peak_rss_kib'] / 1024:.1f} MiB de RSS")
+    print(f"   sesiones activas al terminar: {sessions_left} (timeout {session_timeout:g} s)")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""Microbenchmarks de los caminos calientes con salida JSON y comparación con una línea base
+
+Cubre AuthManager (verify_login, register_user, get_session_data) con 10k-1M usuarios,
+NetworkSessionManager (create_session, verify_active_session, end_session) con 10k sesiones
+y la construcción de comandos de FirewallManager con un runner que sólo los registra.
+
+Uso:
+    python3 benchmarks/bench_micro.py --output base.json
+    python3 benchmarks/bench_micro.py --baseline base.json [--threshold 0.25]
+
+Cada caso se mide en --repeats tandas y el JSON guarda la media de cada una. Con --baseline
+el proceso termina con código 1 si la mejor tanda actual es más lenta que la peor tanda de la
+línea base en más de --threshold (fracción del tiempo por operación) y a la vez en más de
+--noise-floor µs: una regresión tiene que superar la dispersión que ya mostraba la línea base,
+no sólo el ruido (GC, otro proceso) de una ejecución concreta.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from auth_manager import AuthManager, SAVE_SESSION_SQL
+from firewall_manager import FirewallManager, RecordingRunner
+from neighbor_table import NeighborTable
+from password_hasher import PasswordHasher
+from session_manager import NetworkSessionManager
+from bench_session_contention import FakeNeighborSource, percentile
+
+# Coste de scrypt reducido: con el de producción (n=2**14) el hash taparía la parte de SQLite
+BENCH_SCRYPT_N = 2 ** 10
+SEED_CHUNK = 100000
+
+# Tandas por caso (--repeats); las operaciones del caso se reparten entre ellas
+REPEATS = 5
+
+def measure(name, operation, count, warmup=True):
+    """Ejecuta operation(i) count veces en REPEATS tandas y resume la latencia por operación"""
+    # Calentamiento (cachés de SQLite, consultas preparadas); no en operaciones que cambian el estado
+    for i in range(min(count // 10, 100) if warmup else 0):
+        operation(i)
+    repeats = max(1, min(REPEATS, count))
+    samples = []
+    repeat_means = []
+    total = 0.0
+    # i sigue contando entre tandas: las operaciones que cambian el estado nunca repiten argumento
+    for repeat in range(repeats):
+        indices = range(repeat * count // repeats, (repeat + 1) * count // repeats)
+        repeat_samples = []
+        start = time.perf_counter()
+        for i in indices:
+            op_start = time.perf_counter()
+            operation(i)
+            repeat_samples.append(time.perf_counter() - op_start)
+        total += time.perf_counter() - start
+        repeat_means.append(sum(repeat_samples) / len(repeat_samples))
+        samples += repeat_samples
+    return name, {
+        'ops': count,
+        'repeats': repeats,
+        'ops_per_s': round(count / total, 1),
+        # Mediana de las medias por tanda: robusta frente a una tanda con ruido
+        'mean_us': round(statistics.median(repeat_means) * 1e6, 3),
+        'min_mean_us': round(min(repeat_means) * 1e6, 3),
+        'repeat_means_us': [round(mean * 1e6, 3) for mean in repeat_means],
+        'p50_us': round(percentile(samples, 0.50) * 1e6, 3),
+        'p99_us': round(percentile(samples, 0.99) * 1e6, 3),
+    }
+
+def client_ip(i):
+    return f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+
+def bench_auth(tmp, users, iterations):
+    """verify_login, register_user y get_session_data con `users` usuarios y sesiones en la BD"""
+    hasher = PasswordHasher(workers=0, n=BENCH_SCRYPT_N)
+    auth = AuthManager(os.path.join(tmp, f"auth-{users}.db"), hasher=hasher)
+    encoded = hasher.hash('clave')
+    now = datetime.now()
+    start, expire = now.isoformat(), (now + timedelta(hours=1)).isoformat()
+    for offset in range(0, users, SEED_CHUNK):
+        chunk = range(offset, min(offset + SEED_CHUNK, users))
+        auth.insert_users([(f"user{i}", encoded) for i in chunk])
+        with auth.query('bench_seed') as cursor:
+            cursor.executemany(SAVE_SESSION_SQL, [(client_ip(i), f"user{i}", "02:00:00:00:00:01", start, expire, 1)
+                                                  for i in chunk])
+
+    rng = random.Random(users)
+    picks = [rng.randrange(users) for _ in range(iterations)]
+    results = [
+        measure(f"auth.verify_login[{users}]", lambda i: auth.verify_login(f"user{picks[i]}", 'clave'),
+                iterations // 10),
+        measure(f"auth.verify_login_unknown[{users}]", lambda i: auth.verify_login(f"nadie{i}", 'clave'),
+                iterations // 10),
+        measure(f"auth.register_user[{users}]", lambda i: auth.register_user(f"nuevo{i}", 'clave'),
+                iterations // 10, warmup=False),
+        measure(f"auth.get_session_data[{users}]", lambda i: auth.get_session_data(client_ip(picks[i])),
+                iterations),
+    ]
+    auth.close()
+    return results
+
+def bench_sessions(tmp, sessions):
+    """Ciclo de vida de `sessions` sesiones en NetworkSessionManager con firewall y vecinos falsos"""
+    auth = AuthManager(os.path.join(tmp, 'sessions.db'), hasher=PasswordHasher(workers=0, n=BENCH_SCRYPT_N))
+    ips = [client_ip(i) for i in range(sessions)]
+    neighbors = NeighborTable(FakeNeighborSource(ips))
+    firewall = FirewallManager(tmp, backend='ipset', runner=RecordingRunner())
+    manager = NetworkSessionManager(auth, firewall_manager=firewall, neighbor_table=neighbors)
+    macs = [neighbors.lookup(ip) for ip in ips]
+
+    results = [
+        measure(f"sessions.create_session[{sessions}]",
+                lambda i: manager.create_session(ips[i], f"user{i}", macs[i]), sessions, warmup=False),
+        measure(f"sessions.verify_active_session[{sessions}]",
+                lambda i: manager.verify_active_session(ips[i]), sessions),
+        measure(f"sessions.end_session[{sessions}]",
+                lambda i: manager.end_session(ips[i], "logout"), sessions, warmup=False),
+    ]
+    manager.firewall_queue.stop()
+    manager.session_writer.stop()
+    auth.close()
+    return results
+
+def bench_firewall(tmp, iterations):
+    """Construcción de comandos de cada backend y camino completo hasta el runner"""
+    ops = [('allow' if i % 2 else 'deny', client_ip(i), f"02:00:00:00:{i // 256:02X}:{i % 256:02X}")
+           for i in range(256)]
+    results = []
+    for backend in ('script', 'ipset'):
+        manager = FirewallManager(tmp, backend=backend, runner=RecordingRunner())
+        # La mitad de las IPs ya autorizadas, para que también se generen bajas
+        manager.backend.apply_batch([('allow', ip, mac) for _, ip, mac in ops[::2]])
+        results.append(measure(f"firewall.{backend}.build_batch[256]",
+                               lambda i: manager.backend.build_batch(ops), iterations // 10))
+        # Cada vuelta sobre las 256 IPs alterna altas y bajas: ninguna llamada queda vacía
+        manager = FirewallManager(tmp, backend=backend, runner=RecordingRunner())
+        results.append(measure(f"firewall.{backend}.apply_batch[1]",
+                               lambda i: manager.apply_batch([('deny' if i // 256 % 2 else 'allow',
+                                                               ops[i % 256][1])]),
+                               iterations, warmup=False))
+    manager = FirewallManager(tmp, backend='script', runner=RecordingRunner())
+    results.append(measure("firewall.script.unlock_client",
+                           lambda i: manager.unlock_client(ops[i % 256][1]), iterations))
+    return results
+
+def compare(results, baseline, threshold, noise_floor):
+    """Imprime la variación frente a la línea base y devuelve los casos que empeoran"""
+    regressions = []
+    print(f"\n📊 Comparación con la línea base (umbral {threshold:.0%} y {noise_floor:g} µs, "
+          f"mejor tanda actual frente a la peor de la línea base)")
+    for name, stats in results.items():
+        old = baseline.get(name)
+        if old is None:
+            print(f"   {name:<45} {'nuevo':>10}")
+            continue
+        change = stats['mean_us'] / old['mean_us'] - 1 if old['mean_us'] else 0.0
+        # Líneas base sin tandas guardadas: sólo queda la mediana
+        old_worst = max(old.get('repeat_means_us') or [old['mean_us']])
+        best = stats['min_mean_us']
+        spread_change = best / old_worst - 1 if old_worst else 0.0
+        # En los casos de pocos µs un porcentaje alto puede ser sólo ruido del sistema
+        regressed = spread_change > threshold and best - old_worst > noise_floor
+        if regressed:
+            regressions.append(name)
+        print(f"   {name:<45} {old['mean_us']:>10.1f} -> {stats['mean_us']:>10.1f} µs  "
+              f"{change:+7.1%}  (mejor/peor {spread_change:+7.1%}) {'❌' if regressed else '✅'}")
+    return regressions
+
+def run_groups(args, tmp):
+    """Ejecuta los grupos seleccionados con --only y devuelve {caso: estadísticas}"""
+    groups = [('auth', lambda users=users: bench_auth(tmp, users, args.iterations))
+              for users in (int(value) for value in args.users.split(',') if value)]
+    groups += [('sessions', lambda: bench_sessions(tmp, args.sessions)),
+               ('firewall', lambda: bench_firewall(tmp, args.iterations))]
+
+    results = {}
+    for group, run in groups:
+        if args.only and not (group.startswith(args.only) or args.only.startswith(group)):
+            continue
+        # Cualquier salida de los managers queda fuera del informe
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            group_results = run()
+        for name, stats in group_results:
+            if name.startswith(args.only):
+                results[name] = stats
+                print(f"   {name:<45} {stats['ops_per_s']:>12.0f} ops/s  mean {stats['mean_us']:>9.1f} µs  "
+                      f"p50 {stats['p50_us']:>9.1f} µs  p99 {stats['p99_us']:>9.1f} µs")
+                sys.stdout.flush()
+    return results
+
+def main():
+    global REPEATS
+    parser = argparse.ArgumentParser(description="Microbenchmarks de AuthManager, sesiones y firewall")
+    parser.add_argument('--users', default='10000,100000,1000000',
+                        help="Tamaños de la tabla de usuarios (separados por comas)")
+    parser.add_argument('--sessions', type=int, default=10000, help="Sesiones del ciclo de vida")
+    parser.add_argument('--iterations', type=int, default=10000, help="Operaciones por caso rápido")
+    parser.add_argument('--repeats', type=int, default=REPEATS,
+                        help="Tandas por caso; su dispersión decide qué cuenta como regresión")
+    parser.add_argument('--only', default='', help="Sólo los casos cuyo nombre empieza por este prefijo")
+    parser.add_argument('--output', metavar='FICHERO', help="Guarda los resultados en JSON")
+    parser.add_argument('--baseline', metavar='FICHERO', help="JSON de una ejecución anterior para comparar")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="Empeoramiento tolerado de la mejor tanda frente a la peor de la línea base")
+    parser.add_argument('--noise-floor', type=float, default=5.0,
+                        help="µs por operación que un caso debe empeorar, además del umbral, para fallar")
+    args = parser.parse_args()
+    REPEATS = args.repeats
+
+    # Con 1M de usuarios la BD ocupa cientos de MB: se borra al terminar
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run_groups(args, tmp)
+
+    report = {
+        'meta': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'repeats': REPEATS,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold, args.noise_floor)
+        if regressions:
+            print(f"❌ {len(regressions)} casos más lentos que la línea base: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
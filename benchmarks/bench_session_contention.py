@@ -0,0 +1,118 @@
+"""Benchmark de contención: verify_active_session concurrente con logins y logouts
+
+Muchos hilos verifican sesiones (camino rápido y verificaciones completas con consulta
+a BD) mientras otros crean y terminan sesiones. Las lecturas no deberían degradarse
+al aumentar los escritores.
+
+Uso: python3 benchmarks/bench_session_contention.py [lectores] [escritores] [segundos]
+"""
+import contextlib
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from auth_manager import AuthManager
+from firewall_manager import FirewallManager, RecordingRunner
+from neighbor_table import NeighborTable
+from password_hasher import PasswordHasher
+from session_manager import NetworkSessionManager
+
+SESSIONS = 500
+
+class FakeNeighborSource:
+    """Tabla de vecinos fija: una MAC distinta por IP"""
+
+    def __init__(self, ips):
+        self.table = {ip: f"02:00:00:00:{i // 256:02X}:{i % 256:02X}" for i, ip in enumerate(ips)}
+
+    def read(self):
+        return dict(self.table)
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def main():
+    readers = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else 3.0
+
+    reader_ips = [f"10.1.{i // 250}.{i % 250 + 1}" for i in range(SESSIONS)]
+    writer_ips = [f"10.2.{i // 250}.{i % 250 + 1}" for i in range(writers * 50)]
+
+    # La BD y el directorio se borran al terminar
+    with tempfile.TemporaryDirectory() as tmp:
+        auth = AuthManager(os.path.join(tmp, 'bench.db'), hasher=PasswordHasher(workers=0))
+        with auth.query('bench_seed') as cursor:
+            cursor.executemany("INSERT INTO usuarios (username, password) VALUES (?, 'x')",
+                               [(f"u{i}",) for i in range(len(reader_ips) + len(writer_ips))])
+
+        # Firewall falso con el coste de un proceso: no debe notarse en las lecturas
+        firewall = FirewallManager(tmp, backend='ipset', runner=RecordingRunner(delay=0.005))
+        neighbors = NeighborTable(FakeNeighborSource(reader_ips + writer_ips))
+        # TTL corto para que una parte de las verificaciones sea completa (tabla de vecinos + BD)
+        manager = NetworkSessionManager(auth, firewall_manager=firewall, neighbor_table=neighbors,
+                                        mac_check_ttl=0.05)
+
+        stop = threading.Event()
+        latencies = [[] for _ in range(readers)]
+        writes = [0] * writers
+
+        def reader(index):
+            samples = latencies[index]
+            i = index
+            while not stop.is_set():
+                ip = reader_ips[i % len(reader_ips)]
+                start = time.perf_counter()
+                manager.verify_active_session(ip)
+                samples.append(time.perf_counter() - start)
+                i += 7
+
+        def writer(index):
+            ips = writer_ips[index::writers]
+            i = 0
+            while not stop.is_set():
+                ip = ips[i % len(ips)]
+                manager.create_session(ip, f"u{SESSIONS + writer_ips.index(ip)}", neighbors.lookup(ip))
+                manager.end_session(ip, "logout")
+                writes[index] += 1
+                i += 1
+
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for i, ip in enumerate(reader_ips):
+                manager.create_session(ip, f"u{i}", neighbors.lookup(ip))
+            manager.firewall_queue.flush()
+
+            threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+            threads += [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+            for thread in threads:
+                thread.start()
+            time.sleep(duration)
+            stop.set()
+            for thread in threads:
+                thread.join()
+            manager.firewall_queue.flush()
+        manager.firewall_queue.stop()
+        manager.session_writer.stop()
+        auth.close()
+
+    samples = [value for chunk in latencies for value in chunk]
+    stats = manager.get_verification_stats()
+    print(f"⏱️  {readers} lectores, {writers} escritores, {duration:.1f} s")
+    print(f"   verify_active_session: {len(samples) / duration:10.0f} ops/s  "
+          f"p50 {percentile(samples, 0.50) * 1e6:7.1f} µs  "
+          f"p99 {percentile(samples, 0.99) * 1e6:7.1f} µs  "
+          f"max {max(samples, default=0) * 1e6:9.1f} µs")
+    print(f"   login + logout:        {sum(writes) / duration:10.0f} ops/s")
+    print(f"   camino rápido: {stats['fast_path_hits']}  verificaciones completas: {stats['full_checks']}")
+    print(f"   firewall: {manager.firewall_queue.get_stats()}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Microbenchmark: plantillas precompiladas vs. re.sub/str.replace/f-string por solicitud
+
+Uso: python3 benchmarks/bench_templates.py [iteraciones]
+"""
+import os
+import re
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from templates import Template, portal_template
+
+MESSAGE = '<div class="alert error">Usuario ya existe o error en el registro.</div>'
+
+def legacy_inject_message(html, message):
+    """Camino anterior: re.sub con DOTALL sobre todo el HTML + inyección de script"""
+    pattern = r'<div id="register-messages" class="messages-container">.*?</div>'
+    replacement = f'<div id="register-messages" class="messages-container">{message}</div>'
+    html = re.sub(pattern, replacement, html, flags=re.DOTALL)
+    script = """
+        <script>
+            document.addEventListener('DOMContentLoaded', function() {
+                openTab('register');
+            });
+        </script>
+        """
+    return html.replace('</body>', script + '</body>').encode()
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    with open(os.path.join(ROOT, 'portal.html'), encoding='utf-8') as f:
+        portal_text = f.read()
+    with open(os.path.join(ROOT, 'success.html'), encoding='utf-8') as f:
+        success_text = f.read()
+
+    portal = portal_template(portal_text)
+    message = MESSAGE.encode()
+    script = b"<script>openTab('register');</script>"
+
+    success = Template(success_text)
+    # Equivalente al f-string de 6 KB que se reconstruía en cada /status
+    success_format = success_text.replace('{', '{{').replace('}', '}}')
+    success_format = re.sub(r'\{\{\{\{(\w+)\}\}\}\}', r'{\1}', success_format)
+
+    assert (success_format.format(time_remaining='29:59', client_ip='10.0.0.1').encode() ==
+            success.render(time_remaining='29:59', client_ip='10.0.0.1'))
+
+    cases = [
+        ('portal + mensaje (legacy re.sub)', lambda: legacy_inject_message(portal_text, MESSAGE)),
+        ('portal + mensaje (plantilla)', lambda: portal.render(register_message=message, script=script)),
+        ('success_page (legacy f-string)', lambda: success_format.format(time_remaining='29:59', client_ip='192.168.100.77').encode()),
+        ('success_page (plantilla)', lambda: success.render(time_remaining='29:59', client_ip='192.168.100.77')),
+    ]
+
+    print(f"⏱️  {iterations} iteraciones por caso")
+    for name, func in cases:
+        elapsed = min(timeit.repeat(func, number=iterations, repeat=3))
+        print(f"   {name:<36} {elapsed / iterations * 1e6:8.2f} µs/render")
+
+if __name__ == '__main__':
+    main()
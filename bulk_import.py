@@ -0,0 +1,159 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+
+from auth_manager import AuthManager
+from password_hasher import PasswordHasher
+
+def read_users(path, file_format=None):
+    """Lee (username, password) fila a fila desde CSV o JSONL; None para las filas inválidas"""
+    if file_format is None:
+        file_format = 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+    with open(path, newline='', encoding='utf-8') as f:
+        if file_format == 'jsonl':
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    yield str(entry['username']).strip(), str(entry['password'])
+                except (ValueError, KeyError, TypeError):
+                    yield None
+        else:
+            reader = csv.reader(f)
+            for row in reader:
+                if len(row) < 2:
+                    yield None
+                    continue
+                if reader.line_num == 1 and row[0].strip().lower() == 'username':
+                    continue  # Cabecera
+                yield row[0].strip(), row[1]
+
+class BulkImporter:
+    """Importa usuarios en lotes: hash en paralelo y un executemany por lote, con memoria acotada"""
+
+    def __init__(self, auth_manager, hasher, batch_size=1000, hash_chunk=50, max_inflight=4,
+                 duplicates_file=None, progress_interval=2.0):
+        self.auth_manager = auth_manager
+        self.hasher = hasher
+        self.batch_size = batch_size  # Filas por transacción
+        self.hash_chunk = hash_chunk  # Contraseñas por tarea del pool
+        self.max_inflight = max_inflight  # Lotes leídos y aún sin insertar (cota de memoria)
+        self.duplicates_file = duplicates_file
+        self.progress_interval = progress_interval
+        self.inflight = deque()  # [(usernames, [futures])]
+        self.inflight_usernames = set()
+        self.stats = {'read': 0, 'invalid': 0, 'duplicates': 0, 'inserted': 0}
+        self.started_at = 0.0
+        self.last_progress = 0.0
+
+    def run(self, rows):
+        """Importa todas las filas y devuelve los contadores finales"""
+        self.started_at = self.last_progress = time.perf_counter()
+        batch = []
+        for row in rows:
+            self.stats['read'] += 1
+            if row is None or not row[0] or not row[1]:
+                self.stats['invalid'] += 1
+                continue
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self.submit(batch)
+                batch = []
+        if batch:
+            self.submit(batch)
+        while self.inflight:
+            self.complete_oldest()
+        self.report(final=True)
+        return dict(self.stats)
+
+    def submit(self, batch):
+        """Descarta duplicados y encola el hash de las filas nuevas"""
+        users = {}
+        duplicates = []
+        for username, password in batch:
+            if username in users or username in self.inflight_usernames:
+                duplicates.append(username)
+            else:
+                users[username] = password
+        # Los que ya existen no se hashean: scrypt es lo caro de la importación
+        existing = self.auth_manager.existing_usernames(users)
+        for username in existing:
+            del users[username]
+        self.record_duplicates(duplicates + sorted(existing))
+        if not users:
+            return
+
+        usernames = list(users)
+        passwords = list(users.values())
+        futures = [self.hasher.submit_many(passwords[i:i + self.hash_chunk])
+                   for i in range(0, len(passwords), self.hash_chunk)]
+        self.inflight.append((usernames, futures))
+        self.inflight_usernames.update(usernames)
+
+        while len(self.inflight) >= self.max_inflight:
+            self.complete_oldest()
+
+    def complete_oldest(self):
+        """Espera los hashes del lote más antiguo y lo inserta en una transacción"""
+        usernames, futures = self.inflight.popleft()
+        hashes = [encoded for future in futures for encoded in future.result()]
+        inserted = self.auth_manager.insert_users(list(zip(usernames, hashes)))
+        self.inflight_usernames.difference_update(usernames)
+        self.stats['inserted'] += inserted
+        # Registrados por otro proceso después de la comprobación previa
+        self.stats['duplicates'] += len(usernames) - inserted
+
+        if time.perf_counter() - self.last_progress >= self.progress_interval:
+            self.report()
+
+    def record_duplicates(self, usernames):
+        if not usernames:
+            return
+        self.stats['duplicates'] += len(usernames)
+        if self.duplicates_file is not None:
+            self.duplicates_file.writelines(f"{username}\n" for username in usernames)
+
+    def report(self, final=False):
+        self.last_progress = time.perf_counter()
+        elapsed = max(self.last_progress - self.started_at, 1e-9)
+        prefix = "✅ Importación terminada" if final else "📥 Importando"
+        print(f"{prefix}: {self.stats['read']} leídos, {self.stats['inserted']} insertados, "
+              f"{self.stats['duplicates']} duplicados, {self.stats['invalid']} inválidos "
+              f"en {elapsed:.1f} s ({self.stats['inserted'] / elapsed:.0f} usuarios/s)")
+        sys.stdout.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="Importación masiva de usuarios desde CSV o JSONL")
+    parser.add_argument('path', help="Fichero CSV (username,password) o JSONL ({\"username\", \"password\"})")
+    parser.add_argument('--format', choices=['csv', 'jsonl'],
+                        help="Formato del fichero (por defecto según la extensión)")
+    parser.add_argument('--db', default='usuarios.db', help="Base de datos SQLite del portal")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Procesos que calculan scrypt (0 = en el propio proceso)")
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help="Usuarios insertados por transacción")
+    parser.add_argument('--duplicates', metavar='FICHERO',
+                        help="Escribe en este fichero los usernames duplicados")
+    args = parser.parse_args()
+
+    hasher = PasswordHasher(workers=args.workers)
+    auth_manager = AuthManager(args.db, hasher=hasher)
+    duplicates_file = open(args.duplicates, 'w', encoding='utf-8') if args.duplicates else None
+    try:
+        # Suficientes lotes en vuelo para mantener ocupados todos los procesos
+        importer = BulkImporter(auth_manager, hasher, batch_size=args.batch_size,
+                                max_inflight=max(2, args.workers), duplicates_file=duplicates_file)
+        importer.run(read_users(args.path, args.format))
+    finally:
+        if duplicates_file is not None:
+            duplicates_file.close()
+        auth_manager.close()
+
+if __name__ == '__main__':
+    main()
@@ -16,12 +16,20 @@ SSID="MiPortalCautivo"
 PASSWORD="portal123"
 GATEWAY_IP="192.168.100.1"
 SERVER_PORT="8000"
+# Backend de firewall: "ipset" (un set de clientes autorizados, O(1)) o "script" (reglas por IP)
+FIREWALL_BACKEND="ipset"
+IPSET_NAME="portal_allowed"
+IPSET_MATCH_MAC="no"                # "yes": el set guarda parejas IP+MAC (hash:ip,mac)
 
 # Función de limpieza MEJORADA
 cleanup() {
     echo ""
     echo "🧹 Limpiando configuración de forma agresiva..."
     
+    # Dar al servidor la oportunidad de escribir las sesiones pendientes
+    pkill -TERM -f "python3 server.py" 2>/dev/null
+    sleep 1
+
     # Matar procesos de forma más agresiva
     pkill -9 hostapd 2>/dev/null
     pkill -9 dnsmasq 2>/dev/null
@@ -35,6 +43,7 @@ cleanup() {
     iptables -F 2>/dev/null
     iptables -X 2>/dev/null
     iptables -t nat -X 2>/dev/null
+    ipset destroy $IPSET_NAME 2>/dev/null
 
     # Limpiar procesos residuales
     sudo pkill -9 dnsmasq 2>/dev/null
@@ -96,6 +105,7 @@ aggressive_cleanup() {
     iptables -F 2>/dev/null
     iptables -X 2>/dev/null
     iptables -t nat -X 2>/dev/null
+    ipset destroy $IPSET_NAME 2>/dev/null
     
     # Eliminar interfaz virtual de forma forzada
     echo "🗑️  Eliminando interfaz virtual existente..."
@@ -306,7 +316,11 @@ start_webserver() {
     
     if [ -f "server.py" ]; then
         echo "🚀 Ejecutando servidor..."
-        python3 server.py
+        SERVER_ARGS="--firewall-backend $FIREWALL_BACKEND --ipset-name $IPSET_NAME"
+        if [ "$IPSET_MATCH_MAC" = "yes" ]; then
+            SERVER_ARGS="$SERVER_ARGS --ipset-mac"
+        fi
+        python3 server.py $SERVER_ARGS
     else
         echo "❌ No se encuentra server.py"
         echo "Hotspot activo. Ejecuta manualmente: python3 server.py"
@@ -339,6 +353,27 @@ block_all() {
     # PERMITIR acceso al servidor web del portal (puerto 8000)
     iptables -A FORWARD -i $LOCAL_IFACE -p tcp --dport 8000 -j ACCEPT
 
+    # Reglas fijas que consultan el set de clientes autorizados (autorizar = ipset add)
+    if [ "$FIREWALL_BACKEND" = "ipset" ]; then
+        if ! command -v ipset > /dev/null 2>&1; then
+            echo "⚠️  ipset no disponible, usando reglas por IP (unlock.sh/block.sh)"
+            FIREWALL_BACKEND="script"
+        else
+            if [ "$IPSET_MATCH_MAC" = "yes" ]; then
+                ipset create $IPSET_NAME hash:ip,mac -exist
+                SET_MATCH="src,src"
+            else
+                ipset create $IPSET_NAME hash:ip -exist
+                SET_MATCH="src"
+            fi
+            ipset flush $IPSET_NAME
+
+            iptables -A FORWARD -i "$LOCAL_IFACE" -m set --match-set $IPSET_NAME $SET_MATCH -j ACCEPT
+            iptables -A FORWARD -o "$LOCAL_IFACE" -m conntrack --ctstate ESTABLISHED,RELATED -j ACCEPT
+            iptables -t nat -A PREROUTING -i "$LOCAL_IFACE" -m set --match-set $IPSET_NAME $SET_MATCH -p tcp --dport 80 -j ACCEPT
+        fi
+    fi
+
     #Hacer redireccionamiento
     iptables -t nat -A PREROUTING -i "$LOCAL_IFACE" -p tcp --dport 80 -j REDIRECT --to-port 8000
 
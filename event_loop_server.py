@@ -0,0 +1,94 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from http_parser import HttpRequestParser, HttpError, error_response
+from metrics import REGISTRY
+
+logger = logging.getLogger('portal.event_loop_server')
+
+ACTIVE_CONNECTIONS = REGISTRY.gauge('portal_active_connections', 'Conexiones HTTP atendiéndose ahora')
+
+class EventLoopServer:
+    """Sirve las rutas de HotspotServer desde un único event loop (asyncio)"""
+
+    def __init__(self, hotspot, max_workers=8, auth_workers=4, read_timeout=10):
+        self.hotspot = hotspot
+        self.read_timeout = read_timeout
+        # SQLite y renderizado son bloqueantes pero breves: se ejecutan en un pool acotado
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hotspot-io')
+        # Login y registro esperan a scrypt: pool propio para que una avalancha no retrase el portal ni /status
+        self.auth_executor = ThreadPoolExecutor(max_workers=auth_workers, thread_name_prefix='hotspot-auth')
+
+    async def handle_client(self, reader, writer):
+        """Atiende una conexión (con keep-alive) sin bloquear el loop"""
+        addr = writer.get_extra_info('peername')
+        parser = HttpRequestParser()
+        timeout = self.read_timeout
+        served = 0
+        ACTIVE_CONNECTIONS.inc()
+        try:
+            while True:
+                request = parser.next_request()
+                if request is None:
+                    data = await asyncio.wait_for(reader.read(65536), timeout)
+                    if not data:
+                        return
+                    parser.feed(data)
+                    continue
+
+                served += 1
+                keep_alive = request.keep_alive and served < self.hotspot.max_keepalive_requests
+                if request.path == '/styles.css':
+                    # Los archivos estáticos no tocan SQLite ni el firewall
+                    response = self.hotspot.build_response(request, addr[0], keep_alive)
+                else:
+                    # Los intentos rechazados se responden en el loop, sin ocupar el executor
+                    response = self.hotspot.throttle_response(request, addr[0], keep_alive)
+                    if response is None:
+                        executor = self.auth_executor if request.method == 'POST' else self.executor
+                        loop = asyncio.get_running_loop()
+                        response = await loop.run_in_executor(
+                            executor, self.hotspot.build_response, request, addr[0], keep_alive, False
+                        )
+
+                writer.write(response)
+                await writer.drain()
+                if not keep_alive:
+                    return
+                timeout = self.hotspot.keepalive_timeout
+
+        except HttpError as e:
+            writer.write(error_response(e.status))
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error("❌ EventLoopServer Error atendiendo %s: %s", addr, e)
+        finally:
+            ACTIVE_CONNECTIONS.dec()
+            writer.close()
+
+    async def serve(self):
+        """Abre el socket de escucha y atiende conexiones indefinidamente"""
+        server = await asyncio.start_server(
+            self.handle_client,
+            self.hotspot.host,
+            self.hotspot.port,
+            backlog=self.hotspot.backlog,
+            reuse_address=True,
+            reuse_port=self.hotspot.reuse_port
+        )
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        """Ejecuta el event loop hasta que se interrumpa"""
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            logger.error("❌ ERROR: %s", e)
+        finally:
+            self.executor.shutdown(wait=False)
+            self.auth_executor.shutdown(wait=False)
@@ -0,0 +1,113 @@
+import heapq
+import itertools
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger('portal.expiry_scheduler')
+
+class ExpiryScheduler:
+    """Un único hilo que dispara expiraciones programadas (heap con cancelación perezosa)"""
+
+    def __init__(self, handler, tick=0.5):
+        self.handler = handler  # Recibe la lista de claves que vencen en el mismo tick
+        self.tick = tick
+        self.heap = []  # [(deadline, seq, key)], puede contener entradas obsoletas
+        self.entries = {}  # {key: (deadline, seq)} entradas vigentes
+        self.seq = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+
+    def schedule(self, key, deadline):
+        """Programa (o reprograma) la expiración de una clave en el instante `deadline` (time.time)"""
+        with self.condition:
+            entry = (deadline, next(self.seq))
+            self.entries[key] = entry
+            heapq.heappush(self.heap, (entry[0], entry[1], key))
+            self._compact()
+            # Sólo hace falta despertar al hilo si la nueva entrada es la más próxima
+            if self.heap[0][2] == key:
+                self.condition.notify()
+
+    def reschedule(self, key, deadline):
+        """Alias de schedule: la entrada anterior queda invalidada"""
+        self.schedule(key, deadline)
+
+    def cancel(self, key):
+        """Cancela la expiración de una clave; devuelve False si no estaba programada"""
+        with self.condition:
+            return self.entries.pop(key, None) is not None
+
+    def deadline(self, key):
+        """Obtiene el instante programado para una clave, o None"""
+        entry = self.entries.get(key)
+        return entry[0] if entry else None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _compact(self):
+        """Reconstruye el heap cuando las entradas obsoletas superan a las vigentes"""
+        if len(self.heap) > 64 and len(self.heap) > 2 * len(self.entries):
+            self.heap = [(deadline, seq, key) for key, (deadline, seq) in self.entries.items()]
+            heapq.heapify(self.heap)
+
+    def _is_current(self, item):
+        deadline, seq, key = item
+        return self.entries.get(key) == (deadline, seq)
+
+    def start(self):
+        """Arranca el hilo del planificador"""
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, name='expiry-scheduler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Detiene el hilo del planificador"""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+
+    def _next_due(self):
+        """Espera al siguiente tick con vencimientos y devuelve las claves vencidas"""
+        with self.condition:
+            while self.running:
+                while self.heap and not self._is_current(self.heap[0]):
+                    heapq.heappop(self.heap)
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+
+                # Las expiraciones del mismo tick se despachan juntas, nunca antes de tiempo
+                wake_at = math.ceil(self.heap[0][0] / self.tick) * self.tick
+                now = time.time()
+                if wake_at > now:
+                    self.condition.wait(wake_at - now)
+                    continue
+
+                due = []
+                while self.heap and self.heap[0][0] <= wake_at:
+                    item = heapq.heappop(self.heap)
+                    if self._is_current(item):
+                        del self.entries[item[2]]
+                        due.append(item[2])
+                if due:
+                    return due
+            return None
+
+    def _run(self):
+        while True:
+            due = self._next_due()
+            if due is None:
+                return
+            try:
+                self.handler(due)
+            except Exception as e:
+                logger.error("❌ ExpiryScheduler Error procesando expiraciones: %s", e)
@@ -1,50 +1,285 @@
 # firewall_manager.py
+import logging
 import os
 import subprocess
 import re
+import time
+
+from metrics import REGISTRY
+from tracing import TRACER
+
+logger = logging.getLogger('portal.firewall_manager')
+
+FIREWALL_SECONDS = REGISTRY.histogram('portal_firewall_op_seconds',
+                                      'Duración de los comandos de firewall por tipo', ['kind'])
+FIREWALL_FAILURES = REGISTRY.counter('portal_firewall_failures_total',
+                                     'Comandos de firewall fallidos por tipo', ['kind'])
+
+def run_command(command, input=None):
+    """Ejecuta un comando del sistema (lanza CalledProcessError si falla)"""
+    return subprocess.run(
+        command,
+        check=True,
+        capture_output=True,
+        text=True,
+        input=input
+    )
+
+def known_mac(mac):
+    """Indica si la MAC sirve para autorizar la pareja IP+MAC (ni vacía ni 00:00:00:00:00:00)"""
+    return bool(mac) and mac != "00:00:00:00:00:00"
+
+class RecordingRunner:
+    """Runner falso que registra los comandos en lugar de ejecutarlos (pruebas y benchmarks sin root)"""
+
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay  # Simula el coste de crear el proceso
+        self.fail = fail
+        self.calls = []  # [(command, input)]
+
+    def __call__(self, command, input=None):
+        self.calls.append((command, input))
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail:
+            raise subprocess.CalledProcessError(1, command, '', 'error simulado')
+        return subprocess.CompletedProcess(command, 0, 'ok', '')
+
+class ScriptBackend:
+    """Reglas iptables por IP mediante unlock.sh / block.sh"""
+
+    name = 'script'
+    requires_mac = False
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.allowed = set()  # IPs con reglas ACCEPT instaladas por este proceso
+
+    def allow(self, client_ip, mac=None):
+        success = self.manager.run_script('unlock.sh', [client_ip])
+        if success:
+            self.allowed.add(client_ip)
+        return success
+
+    def deny(self, client_ip):
+        success = self.manager.run_script('block.sh', [client_ip])
+        if success:
+            self.allowed.discard(client_ip)
+        return success
+
+    def build_batch(self, ops):
+        """Entrada de `iptables-restore --noflush` que aplica todas las operaciones"""
+        filter_rules = []
+        nat_rules = []
+        for action, client_ip, mac in ops:
+            if action == 'allow' and client_ip not in self.allowed:
+                filter_rules += [f"-I FORWARD -s {client_ip} -j ACCEPT",
+                                 f"-I FORWARD -d {client_ip} -j ACCEPT"]
+                nat_rules.append(f"-I PREROUTING -s {client_ip} -p tcp --dport 80 -j ACCEPT")
+            elif action == 'deny' and client_ip in self.allowed:
+                # Sólo se borran reglas que existen: un -D fallido abortaría toda la transacción
+                filter_rules += [f"-D FORWARD -s {client_ip} -j ACCEPT",
+                                 f"-D FORWARD -d {client_ip} -j ACCEPT"]
+                nat_rules.append(f"-D PREROUTING -s {client_ip} -p tcp --dport 80 -j ACCEPT")
+        if not filter_rules:
+            return None
+        lines = ['*filter'] + filter_rules + ['COMMIT', '*nat'] + nat_rules + ['COMMIT']
+        return ['sudo', 'iptables-restore', '--noflush'], '\n'.join(lines) + '\n'
+
+    def apply_batch(self, ops):
+        batch = self.build_batch(ops)
+        if batch is None:
+            return True
+        command, rules = batch
+        if not self.manager.run_command(command, 'iptables-restore', rules):
+            return False
+        for action, client_ip, _ in ops:
+            if action == 'allow':
+                self.allowed.add(client_ip)
+            else:
+                self.allowed.discard(client_ip)
+        return True
+
+class IpsetBackend:
+    """Clientes autorizados en un set de ipset: autorizar o revocar es un único add/del"""
+
+    name = 'ipset'
+
+    def __init__(self, manager, set_name='portal_allowed', match_mac=False):
+        self.manager = manager
+        self.set_name = set_name
+        self.match_mac = match_mac  # Set hash:ip,mac en lugar de hash:ip
+        self.requires_mac = match_mac  # Sin MAC conocida no se puede autorizar
+        self.macs = {}  # {ip: mac} añadidas, para poder borrar la pareja exacta
+
+    def entry(self, client_ip, mac=None):
+        """Elemento del set para un cliente ('ip' o 'ip,mac')"""
+        if self.match_mac and mac:
+            return f"{client_ip},{mac}"
+        return client_ip
+
+    def allow(self, client_ip, mac=None):
+        if self.match_mac:
+            if not known_mac(mac):
+                logger.error("❌ FirewallManager: MAC desconocida para %s, no se puede autorizar", client_ip)
+                return False
+            old_mac = self.macs.get(client_ip)
+            if old_mac and old_mac != mac:
+                # La IP cambió de MAC: la pareja anterior no puede seguir autorizada
+                if not self.manager.run_command(
+                        ['sudo', 'ipset', 'del', self.set_name, self.entry(client_ip, old_mac), '-exist'],
+                        'ipset del'):
+                    return False
+            self.macs[client_ip] = mac
+        return self.manager.run_command(
+            ['sudo', 'ipset', 'add', self.set_name, self.entry(client_ip, mac), '-exist'], 'ipset add'
+        )
+
+    def deny(self, client_ip):
+        mac = self.macs.pop(client_ip, None)
+        if self.match_mac and not mac:
+            return True  # Nunca se añadió
+        return self.manager.run_command(
+            ['sudo', 'ipset', 'del', self.set_name, self.entry(client_ip, mac), '-exist'], 'ipset del'
+        )
+
+    def build_batch(self, ops):
+        """Entrada de `ipset restore` con todas las altas y bajas"""
+        lines = []
+        batch_macs = {}  # MAC de cada IP tras las operaciones anteriores del lote
+        for action, client_ip, mac in ops:
+            old_mac = batch_macs[client_ip] if client_ip in batch_macs else self.macs.get(client_ip)
+            if action == 'allow':
+                if self.match_mac and not known_mac(mac):
+                    continue  # FirewallManager.apply_batch ya la da por fallida
+                if self.match_mac and old_mac and old_mac != mac:
+                    # La IP cambió de MAC: se borra la pareja anterior en la misma transacción
+                    lines.append(f"del {self.set_name} {self.entry(client_ip, old_mac)} -exist")
+                lines.append(f"add {self.set_name} {self.entry(client_ip, mac)} -exist")
+                batch_macs[client_ip] = mac
+            else:
+                if self.match_mac and not old_mac:
+                    continue
+                lines.append(f"del {self.set_name} {self.entry(client_ip, old_mac)} -exist")
+                batch_macs[client_ip] = None
+        if not lines:
+            return None
+        return ['sudo', 'ipset', 'restore'], '\n'.join(lines) + '\n'
+
+    def apply_batch(self, ops):
+        batch = self.build_batch(ops)
+        if batch is None:
+            return True
+        command, entries = batch
+        if not self.manager.run_command(command, 'ipset restore', entries):
+            return False
+        if self.match_mac:
+            for action, client_ip, mac in ops:
+                if action == 'allow' and mac:
+                    self.macs[client_ip] = mac
+                elif action == 'deny':
+                    self.macs.pop(client_ip, None)
+        return True
 
 class FirewallManager:
     """Maneja operaciones de firewall (bloquear/desbloquear IPs)"""
 
-    def __init__(self, scripts_dir='.'):
+    def __init__(self, scripts_dir='.', backend='script', runner=None, ipset_name='portal_allowed',
+                 ipset_mac=False):
         self.scripts_dir = scripts_dir
+        self.runner = runner or run_command  # Inyectable para pruebas sin root
+        if backend == 'ipset':
+            self.backend = IpsetBackend(self, ipset_name, ipset_mac)
+        else:
+            self.backend = ScriptBackend(self)
+        # El backend autoriza parejas IP+MAC: una sesión sin MAC conocida no puede desbloquearse aún
+        self.requires_mac = self.backend.requires_mac
 
-    def unlock_client(self, client_ip):
+    def unlock_client(self, client_ip, mac=None):
         """Desbloquea un cliente en el firewall"""
-        print(f"FirewallManager: Desbloqueando {client_ip}")
-        return self.run_script('unlock.sh', [client_ip])
-        
-    
+        logger.debug("FirewallManager: Desbloqueando %s", client_ip)
+        return self.backend.allow(client_ip, mac)
+
+
     def block_client(self, client_ip):
         """Bloquea un cliente en el firewall"""
-        print(f"FirewallManager: Bloqueando {client_ip}")
-        return self.run_script('block.sh', [client_ip])
-    
+        logger.debug("FirewallManager: Bloqueando %s", client_ip)
+        return self.backend.deny(client_ip)
+
+    def apply_batch(self, ops):
+        """Aplica una lista de operaciones ('allow'|'deny', ip[, mac]) en una sola transacción
+
+        Devuelve {ip: aplicada}: si la transacción falla, el resultado de cada IP es el de su reintento.
+        """
+        # Si hay varias operaciones para la misma IP sólo cuenta la última
+        latest = {}
+        for op in ops:
+            action, client_ip = op[0], op[1]
+            mac = op[2] if len(op) > 2 else None
+            latest.pop(client_ip, None)
+            latest[client_ip] = (action, client_ip, mac)
+        ops = list(latest.values())
+        results = {}
+        if self.requires_mac:
+            # Igual que backend.allow: sin MAC no hay pareja que añadir, y no cuenta como aplicada
+            for action, client_ip, mac in ops:
+                if action == 'allow' and not known_mac(mac):
+                    logger.error("❌ FirewallManager: MAC desconocida para %s, no se puede autorizar", client_ip)
+                    results[client_ip] = False
+            ops = [op for op in ops if op[1] not in results]
+        if not ops:
+            return results
+
+        logger.debug("FirewallManager: Aplicando lote de %d operaciones", len(ops))
+        if self.backend.apply_batch(ops):
+            results.update((client_ip, True) for _, client_ip, _ in ops)
+            return results
+
+        # Si la transacción falla se reintenta cliente por cliente: un cliente problemático
+        # no debe arrastrar al resto del lote
+        logger.warning("⚠️ FirewallManager: Lote fallido, aplicando operaciones una a una")
+        for action, client_ip, mac in ops:
+            if action == 'allow':
+                results[client_ip] = self.backend.allow(client_ip, mac)
+            else:
+                results[client_ip] = self.backend.deny(client_ip)
+        return results
+
+    def run_command(self, command, description, input=None):
+        """Ejecuta un comando de firewall con el runner configurado"""
+        start = time.perf_counter()
+        try:
+            self.runner(command, input=input)
+            return True
+        except subprocess.CalledProcessError as e:
+            FIREWALL_FAILURES.inc(description)
+            logger.error("❌ Error ejecutando %s: %s", description, e.stderr)
+            return False
+        finally:
+            elapsed = time.perf_counter() - start
+            FIREWALL_SECONDS.observe(elapsed, description)
+            TRACER.add_span(f"firewall.{description}", start, elapsed)
+
     def run_script(self, script_name, parameters=None):
         """Ejecuta scripts externos"""
         script_path = os.path.join(self.scripts_dir, script_name)
-        
+
+        start = time.perf_counter()
         try:
             if parameters:
                 command = ['sudo', script_path] + parameters
-                result = subprocess.run(
-                    command, 
-                    check=True, 
-                    capture_output=True, 
-                    text=True
-                )
+                result = self.runner(command)
             else:
-                result = subprocess.run(
-                    ['sudo', script_path], 
-                    check=True, 
-                    capture_output=True, 
-                    text=True
-                )
-            
-            print(f"✅ {result.stdout.strip()}")
+                result = self.runner(['sudo', script_path])
+
+            logger.debug("✅ %s", result.stdout.strip())
             return True
-            
+
         except subprocess.CalledProcessError as e:
-            print(f"❌ Error ejecutando {script_name}: {e.stderr}")
+            FIREWALL_FAILURES.inc(script_name)
+            logger.error("❌ Error ejecutando %s: %s", script_name, e.stderr)
             return False
- 
\ No newline at end of file
+        finally:
+            elapsed = time.perf_counter() - start
+            FIREWALL_SECONDS.observe(elapsed, script_name)
+            TRACER.add_span(f"firewall.{script_name}", start, elapsed)
@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+
+from tracing import TRACER
+
+logger = logging.getLogger('portal.firewall_queue')
+
+class FirewallQueue:
+    """Cola de operaciones de firewall aplicadas por un hilo dedicado, fuera del camino HTTP"""
+
+    def __init__(self, firewall_manager, batch_window=0.02, max_batch=256):
+        self.firewall_manager = firewall_manager
+        self.batch_window = batch_window  # Espera breve para agrupar operaciones en un lote
+        self.max_batch = max_batch
+        self.pending = {}  # {ip: (action, mac, [callbacks])}, en orden de llegada
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.running = False
+        self.thread = None
+        self.stats = {'submitted': 0, 'coalesced': 0, 'batches': 0, 'applied': 0, 'failed': 0}
+
+    def submit(self, action, client_ip, mac=None, callback=None):
+        """Encola 'allow' o 'deny' para una IP; callback(ip, action, estado) al terminar"""
+        superseded = None
+        with self.condition:
+            self.stats['submitted'] += 1
+            previous = self.pending.pop(client_ip, None)
+            callbacks = [callback] if callback else []
+            if previous is not None:
+                # Sólo cuenta la última operación (p. ej. unlock seguido de block)
+                self.stats['coalesced'] += 1
+                superseded = (previous[0], previous[2])
+            self.pending[client_ip] = (action, mac, callbacks)
+            self.condition.notify()
+
+        if superseded:
+            old_action, old_callbacks = superseded
+            self._notify(old_callbacks, client_ip, old_action, 'superseded')
+
+    def pending_action(self, client_ip):
+        """Operación aún no aplicada para una IP, o None"""
+        entry = self.pending.get(client_ip)
+        return entry[0] if entry else None
+
+    def start(self):
+        """Arranca el hilo que aplica las operaciones"""
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, name='firewall-queue', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5.0):
+        """Aplica lo pendiente y detiene el hilo"""
+        self.flush(timeout)
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def flush(self, timeout=5.0):
+        """Espera a que no queden operaciones pendientes ni en curso"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while self.pending or self.in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def get_stats(self):
+        """Obtiene contadores de operaciones encoladas, agrupadas y aplicadas"""
+        with self.condition:
+            stats = dict(self.stats)
+            stats['pending'] = len(self.pending)
+            return stats
+
+    def _take_batch(self):
+        with self.condition:
+            while self.running and not self.pending:
+                self.condition.wait()
+            if not self.pending:
+                return None
+
+        # Dejar que lleguen más operaciones para aplicarlas juntas
+        if self.batch_window:
+            time.sleep(self.batch_window)
+
+        with self.condition:
+            batch = []
+            for client_ip in list(self.pending)[:self.max_batch]:
+                action, mac, callbacks = self.pending.pop(client_ip)
+                batch.append((action, client_ip, mac, callbacks))
+            self.in_flight = len(batch)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+
+            # El lote se aplica fuera de cualquier solicitud: tiene su propia traza
+            TRACER.begin('firewall_batch', operations=len(batch))
+            try:
+                results = self.firewall_manager.apply_batch(
+                    [(action, client_ip, mac) for action, client_ip, mac, _ in batch]
+                )
+            except Exception as e:
+                logger.error("❌ FirewallQueue Error aplicando lote: %s", e)
+                results = {}
+
+            # Cada IP recibe su propio resultado: un fallo no termina las sesiones del resto del lote
+            statuses = {client_ip: 'applied' if results.get(client_ip) else 'failed'
+                        for _, client_ip, _, _ in batch}
+            failed = sum(1 for status in statuses.values() if status == 'failed')
+            TRACER.end(status='applied' if not failed else 'failed', failed=failed)
+            with self.condition:
+                self.stats['batches'] += 1
+                self.stats['applied'] += len(batch) - failed
+                self.stats['failed'] += failed
+
+            for action, client_ip, _, callbacks in batch:
+                self._notify(callbacks, client_ip, action, statuses[client_ip])
+
+            with self.condition:
+                self.in_flight = 0
+                self.condition.notify_all()
+
+    def _notify(self, callbacks, client_ip, action, status):
+        for callback in callbacks:
+            try:
+                callback(client_ip, action, status)
+            except Exception as e:
+                logger.error("❌ FirewallQueue Error en callback para %s: %s", client_ip, e)
@@ -0,0 +1,134 @@
+import time
+
+STATUS_REASONS = {
+    400: 'Bad Request',
+    413: 'Payload Too Large',
+    431: 'Request Header Fields Too Large',
+    501: 'Not Implemented',
+}
+
+class HttpError(Exception):
+    """Solicitud malformada o fuera de los límites permitidos"""
+
+    def __init__(self, status, message=''):
+        super().__init__(message or STATUS_REASONS.get(status, ''))
+        self.status = status
+
+def error_response(status):
+    """Respuesta mínima para un error de protocolo (siempre cierra la conexión)"""
+    reason = STATUS_REASONS.get(status, 'Error')
+    body = reason.encode()
+    return (
+        f"HTTP/1.1 {status} {reason}\r\n"
+        "Content-Type: text/plain; charset=utf-8\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n"
+        "\r\n"
+    ).encode() + body
+
+class HttpRequest:
+    """Solicitud HTTP completa (cabeceras y cuerpo ya delimitados)"""
+
+    __slots__ = ('method', 'path', 'version', 'headers', 'body', 'parse_seconds')
+
+    def __init__(self, method, path, version, headers, body):
+        self.method = method
+        self.path = path
+        self.version = version
+        self.headers = headers  # {nombre en minúsculas: valor}
+        self.body = body
+        self.parse_seconds = 0.0  # Tiempo de la llamada a next_request que completó la solicitud
+
+    @property
+    def keep_alive(self):
+        """Indica si el cliente quiere reutilizar la conexión"""
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    @property
+    def data(self):
+        """Texto de la solicitud (cabeceras + cuerpo) como lo espera process_request"""
+        head = f"{self.method} {self.path} {self.version}\r\n"
+        head += ''.join(f"{name}: {value}\r\n" for name, value in self.headers.items())
+        return head + "\r\n" + self.body.decode('utf-8', errors='ignore')
+
+class HttpRequestParser:
+    """Parser incremental de HTTP/1.1: acumula bytes y devuelve solicitudes completas"""
+
+    def __init__(self, max_header_size=8192, max_body_size=65536):
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+        self.buffer = bytearray()
+        self.pending = None  # Cabeceras ya parseadas esperando el cuerpo
+        self.body_length = 0
+
+    def feed(self, data):
+        """Añade bytes recibidos del socket"""
+        self.buffer += data
+
+    def next_request(self):
+        """Devuelve la siguiente solicitud completa, o None si faltan bytes"""
+        start = time.perf_counter()
+        if self.pending is None:
+            end = self.buffer.find(b'\r\n\r\n')
+            separator = 4
+            if end == -1:
+                # Tolerar clientes que sólo usan '\n'
+                end = self.buffer.find(b'\n\n')
+                separator = 2
+            if end == -1:
+                if len(self.buffer) > self.max_header_size:
+                    raise HttpError(431)
+                return None
+            if end > self.max_header_size:
+                raise HttpError(431)
+
+            head = bytes(self.buffer[:end]).decode('latin-1')
+            del self.buffer[:end + separator]
+            self.pending = self._parse_head(head)
+
+        if len(self.buffer) < self.body_length:
+            return None
+
+        method, path, version, headers = self.pending
+        body = bytes(self.buffer[:self.body_length])
+        del self.buffer[:self.body_length]
+        self.pending = None
+        self.body_length = 0
+        request = HttpRequest(method, path, version, headers, body)
+        request.parse_seconds = time.perf_counter() - start
+        return request
+
+    def _parse_head(self, head):
+        """Parsea la línea de solicitud y las cabeceras"""
+        lines = head.replace('\r\n', '\n').split('\n')
+        parts = lines[0].split(' ')
+        if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+            raise HttpError(400, 'Línea de solicitud inválida')
+        method, path, version = parts
+
+        headers = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, sep, value = line.partition(':')
+            if not sep:
+                raise HttpError(400, 'Cabecera inválida')
+            headers[name.strip().lower()] = value.strip()
+
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise HttpError(501, 'Transfer-Encoding chunked no soportado')
+
+        try:
+            length = int(headers.get('content-length', '0'))
+        except ValueError:
+            raise HttpError(400, 'Content-Length inválido')
+        if length < 0:
+            raise HttpError(400, 'Content-Length inválido')
+        if length > self.max_body_size:
+            raise HttpError(413)
+
+        self.body_length = length
+        return method, path, version, headers
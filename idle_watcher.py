@@ -0,0 +1,103 @@
+import logging
+import queue
+import selectors
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger('portal.idle_watcher')
+
+class IdleWatcher:
+    """Conexiones keep-alive inactivas esperando en un selector en lugar de en un hilo del pool"""
+
+    def __init__(self, on_ready, timeout=5.0, max_idle=4096):
+        self.on_ready = on_ready  # Recibe (conn, addr, estado) cuando llega la siguiente solicitud
+        self.timeout = timeout  # Segundos de inactividad antes de cerrar
+        self.max_idle = max_idle  # Con más conexiones aparcadas se cierran las más antiguas
+        self.selector = selectors.DefaultSelector()
+        self.incoming = queue.SimpleQueue()  # Aparcadas por los hilos del pool, pendientes de registrar
+        self.deadlines = OrderedDict()  # {conn: instante de cierre}, en orden de llegada (mismo timeout)
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.wakeup_send.setblocking(False)
+        self.selector.register(self.wakeup_recv, selectors.EVENT_READ)
+        self.stats = {'parked': 0, 'resumed': 0, 'expired': 0}
+        self.thread = None
+        self.running = False
+
+    def park(self, conn, addr, state):
+        """Deja una conexión sin solicitud pendiente a la espera de datos; el hilo queda libre"""
+        self.incoming.put((conn, addr, state))
+        try:
+            self.wakeup_send.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass  # El buffer lleno ya garantiza que el hilo se despierte
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def start(self):
+        """Arranca el hilo del selector"""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='idle-watcher', daemon=True)
+        self.thread.start()
+
+    def _register_incoming(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                conn, addr, state = self.incoming.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                self.selector.register(conn, selectors.EVENT_READ, (addr, state))
+            except (ValueError, OSError):
+                conn.close()  # Cerrada por el cliente mientras se aparcaba
+                continue
+            self.deadlines[conn] = deadline
+            self.stats['parked'] += 1
+            if len(self.deadlines) > self.max_idle:
+                self._close(next(iter(self.deadlines)))
+                self.stats['expired'] += 1
+
+    def _close(self, conn):
+        del self.deadlines[conn]
+        self.selector.unregister(conn)
+        conn.close()
+
+    def _run(self):
+        while self.running:
+            timeout = None
+            if self.deadlines:
+                timeout = max(0.0, next(iter(self.deadlines.values())) - time.monotonic())
+            for key, _ in self.selector.select(timeout):
+                if key.fileobj is self.wakeup_recv:
+                    try:
+                        while self.wakeup_recv.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                conn = key.fileobj
+                del self.deadlines[conn]
+                self.selector.unregister(conn)
+                self.stats['resumed'] += 1
+                addr, state = key.data
+                try:
+                    self.on_ready(conn, addr, state)
+                except Exception as e:
+                    logger.error("❌ IdleWatcher Error devolviendo conexión: %s", e)
+                    conn.close()
+            self._register_incoming()
+
+            # Todas comparten timeout: las más antiguas están al principio
+            now = time.monotonic()
+            while self.deadlines:
+                conn, deadline = next(iter(self.deadlines.items()))
+                if deadline > now:
+                    break
+                self._close(conn)
+                self.stats['expired'] += 1
@@ -0,0 +1,183 @@
+import bisect
+import logging
+import threading
+import time
+
+logger = logging.getLogger('portal.metrics')
+
+# Límites (segundos) de los histogramas de latencia: de 100 µs (caché, tabla de vecinos) a 10 s (scrypt, iptables)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(labelnames, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Contador monótono, opcionalmente con etiquetas"""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}  # {valores de etiquetas: total}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        for labels, value in items:
+            yield self.name + _format_labels(self.labelnames, labels), value
+
+class Gauge(Counter):
+    """Valor que sube y baja (p. ej. conexiones abiertas)"""
+
+    type = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+class CallbackMetric:
+    """Métrica que se lee al exportar: callback() devuelve un número o {valores de etiquetas: número}"""
+
+    def __init__(self, name, help, callback, type='gauge', labelnames=()):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.type = type
+        self.labelnames = tuple(labelnames)
+
+    def samples(self):
+        value = self.callback()
+        if isinstance(value, dict):
+            for labels, sample in value.items():
+                if not isinstance(labels, tuple):
+                    labels = (labels,)
+                yield self.name + _format_labels(self.labelnames, labels), sample
+        else:
+            yield self.name, value
+
+class Histogram:
+    """Histograma de buckets fijos: observe() es un bisect y una suma bajo un lock corto"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}  # {valores de etiquetas: [conteos por bucket (+Inf al final), suma]}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, *labels):
+        """Context manager que observa la duración del bloque"""
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self.lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self.series.items()]
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                yield self.name + '_bucket' + _format_labels(self.labelnames, labels, le), cumulative
+            yield self.name + '_sum' + _format_labels(self.labelnames, labels), total
+            yield self.name + '_count' + _format_labels(self.labelnames, labels), cumulative
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+class MetricsRegistry:
+    """Conjunto de métricas exportadas en formato de texto de Prometheus"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        """Registra una métrica; si ya existe una con ese nombre se reemplaza"""
+        with self.lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def _get_or_create(self, cls, name, *args):
+        # Un módulo importado dos veces (p. ej. server.py como __main__) comparte la misma métrica
+        with self.lock:
+            metric = self.metrics.get(name)
+            if not isinstance(metric, cls):
+                metric = self.metrics[name] = cls(name, *args)
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._get_or_create(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, help, labelnames, buckets)
+
+    def callback(self, name, help, callback, type='gauge', labelnames=()):
+        return self.register(CallbackMetric(name, help, callback, type, labelnames))
+
+    def render(self):
+        """Genera la exposición completa (text/plain; version=0.0.4)"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.warning("⚠️ MetricsRegistry Error leyendo %s: %s", metric.name, e)
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(f"{name} {_format_value(value)}" for name, value in samples)
+        return '\n'.join(lines) + '\n'
+
+# Registro del proceso: cada módulo declara aquí sus métricas
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+
+from metrics import REGISTRY
+from tracing import TRACER
+
+logger = logging.getLogger('portal.neighbor_table')
+
+EMPTY_MAC = "00:00:00:00:00:00"
+
+LOOKUP_SECONDS = REGISTRY.histogram('portal_neighbor_lookup_seconds',
+                                    'Duración de las búsquedas IP→MAC (incluye refrescos síncronos)')
+REFRESH_SECONDS = REGISTRY.histogram('portal_neighbor_refresh_seconds',
+                                     'Duración de la lectura completa de la tabla de vecinos')
+
+class ProcArpSource:
+    """Lee la tabla ARP completa desde /proc/net/arp (sin crear procesos)"""
+
+    def __init__(self, path='/proc/net/arp'):
+        self.path = path
+
+    def read(self):
+        """Devuelve {ip: mac} con las entradas completas"""
+        table = {}
+        with open(self.path, 'r') as f:
+            next(f, None)  # Cabecera
+            for line in f:
+                parts = line.split()
+                if len(parts) < 4:
+                    continue
+                ip, flags, mac = parts[0], parts[2], parts[3].upper()
+                # Flags 0x0: entrada incompleta (el vecino no respondió)
+                if flags == '0x0' or mac == EMPTY_MAC:
+                    continue
+                table[ip] = mac
+        return table
+
+class IpNeighSource:
+    """Obtiene la tabla de vecinos con un único `ip -j neigh show`"""
+
+    def __init__(self, timeout=3):
+        self.timeout = timeout
+
+    def read(self):
+        """Devuelve {ip: mac} con las entradas válidas"""
+        result = subprocess.run(
+            ['ip', '-j', 'neigh', 'show'],
+            capture_output=True,
+            text=True,
+            timeout=self.timeout,
+            check=True
+        )
+        table = {}
+        for entry in json.loads(result.stdout or '[]'):
+            mac = entry.get('lladdr')
+            states = entry.get('state', [])
+            if not mac or 'FAILED' in states or 'INCOMPLETE' in states:
+                continue
+            table[entry['dst']] = mac.upper()
+        return table
+
+def default_source():
+    """Elige /proc/net/arp si existe y si no `ip -j neigh`"""
+    if os.path.exists('/proc/net/arp'):
+        return ProcArpSource()
+    return IpNeighSource()
+
+class NeighborTable:
+    """Mapa IP→MAC en memoria que se refresca en bloque desde una fuente inyectable"""
+
+    def __init__(self, source=None, max_age=2.0, miss_refresh_interval=0.5):
+        self.source = source or default_source()
+        self.max_age = max_age  # Antigüedad máxima de la tabla para dar por buena una MAC
+        self.miss_refresh_interval = miss_refresh_interval  # Evita refrescos en bucle por IPs desconocidas
+        self.table = {}
+        self.refreshed_at = 0.0
+        self.refresh_lock = threading.Lock()
+        self.listeners = []  # Funciones (ip, mac_anterior, mac_nueva) avisadas en cada cambio
+        self.refresh_count = 0
+
+    def add_listener(self, callback):
+        """Registra una función que se llama cuando cambia la MAC de una IP"""
+        self.listeners.append(callback)
+
+    def lookup(self, ip):
+        """Obtiene la MAC de una IP (O(1) mientras la tabla esté fresca)"""
+        start = time.perf_counter()
+        mac = self.table.get(ip)
+        age = time.monotonic() - self.refreshed_at
+        if not ((mac is not None and age < self.max_age) or (mac is None and age < self.miss_refresh_interval)):
+            self.refresh(self.max_age if mac is not None else self.miss_refresh_interval)
+            mac = self.table.get(ip)
+        LOOKUP_SECONDS.observe(time.perf_counter() - start)
+        return mac
+
+    def refresh(self, max_age=0.0):
+        """Vuelve a leer la tabla completa; las llamadas concurrentes comparten una sola lectura"""
+        with self.refresh_lock:
+            # Otro hilo pudo refrescar mientras esperábamos el lock
+            if time.monotonic() - self.refreshed_at < max_age:
+                return
+            try:
+                with REFRESH_SECONDS.time(), TRACER.span('neighbor.refresh'):
+                    new_table = self.source.read()
+            except Exception as e:
+                logger.warning("⚠️ NeighborTable Error leyendo tabla de vecinos: %s", e)
+                self.refreshed_at = time.monotonic()
+                return
+
+            old_table = self.table
+            self.table = new_table
+            self.refreshed_at = time.monotonic()
+            self.refresh_count += 1
+
+        if self.listeners:
+            for ip in old_table.keys() | new_table.keys():
+                old_mac, new_mac = old_table.get(ip), new_table.get(ip)
+                if old_mac != new_mac:
+                    for callback in self.listeners:
+                        callback(ip, old_mac, new_mac)
+
+    def start(self, interval=1.0):
+        """Refresca la tabla periódicamente en un hilo para que las búsquedas no esperen"""
+        def _loop():
+            while True:
+                self.refresh()
+                time.sleep(interval)
+
+        thread = threading.Thread(target=_loop, name='neighbor-table', daemon=True)
+        thread.start()
+        return thread
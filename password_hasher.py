@@ -0,0 +1,146 @@
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from tracing import TRACER
+
+class HasherBusyError(Exception):
+    """La cola de derivaciones pendientes está llena"""
+
+def legacy_hash(password):
+    """Hash SHA256 sin sal usado antes de migrar a scrypt"""
+    return hashlib.sha256(password.encode()).hexdigest()
+
+def is_legacy_hash(stored):
+    """Indica si el valor almacenado es un SHA256 antiguo"""
+    return len(stored) == 64 and '$' not in stored
+
+def _derive(password, salt, n, r, p):
+    """Deriva la clave con scrypt (se ejecuta en un proceso del pool)"""
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r + 1024 * 1024, dklen=32)
+
+def _hash_job(password, n, r, p):
+    """Genera un hash nuevo y devuelve (hash, segundos de CPU invertidos)"""
+    start = time.perf_counter()
+    salt = os.urandom(16)
+    key = _derive(password, salt, n, r, p)
+    encoded = f"scrypt${n}${r}${p}${salt.hex()}${key.hex()}"
+    return encoded, time.perf_counter() - start
+
+def _hash_many_job(passwords, n, r, p):
+    """Genera los hashes de un bloque de contraseñas en una sola tarea del pool"""
+    return [_hash_job(password, n, r, p)[0] for password in passwords]
+
+def _verify_job(password, stored):
+    """Verifica una contraseña y devuelve (válida, segundos de CPU invertidos)"""
+    start = time.perf_counter()
+    if is_legacy_hash(stored):
+        valid = hmac.compare_digest(legacy_hash(password), stored)
+    else:
+        try:
+            _, n, r, p, salt, key = stored.split('$')
+            derived = _derive(password, bytes.fromhex(salt), int(n), int(r), int(p))
+            valid = hmac.compare_digest(derived.hex(), key)
+        except ValueError:
+            valid = False
+    return valid, time.perf_counter() - start
+
+class PasswordHasher:
+    """Deriva y verifica contraseñas con scrypt en un pool de procesos con cola acotada"""
+
+    def __init__(self, workers=2, max_pending=32, queue_timeout=5.0, n=2 ** 14, r=8, p=1):
+        self.n = n
+        self.r = r
+        self.p = p
+        # Hash con el coste actual que no corresponde a ninguna contraseña (ver verify_dummy)
+        self.dummy_hash = f"scrypt${n}${r}${p}${os.urandom(16).hex()}${os.urandom(32).hex()}"
+        self.queue_timeout = queue_timeout  # Segundos esperando hueco antes de rechazar
+        self.slots = threading.BoundedSemaphore(workers + max_pending) if workers > 0 else None
+        self.executor = None
+        if workers > 0:
+            # forkserver evita hacer fork de un proceso con hilos ya en marcha
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self.executor = ProcessPoolExecutor(max_workers=workers,
+                                                mp_context=multiprocessing.get_context(method))
+        self.stats_lock = threading.Lock()
+        self.stats = {'jobs': 0, 'rejected': 0, 'queue_wait': 0.0, 'queue_wait_max': 0.0,
+                      'hash_time': 0.0, 'hash_time_max': 0.0}
+
+    def hash(self, password):
+        """Genera un hash scrypt con sal aleatoria"""
+        encoded, _ = self._run(_hash_job, password, self.n, self.r, self.p)
+        return encoded
+
+    def submit_many(self, passwords):
+        """Encola el hash de un bloque de contraseñas; devuelve un Future con la lista de hashes"""
+        # Para importaciones masivas: no pasa por la cola acotada de las solicitudes HTTP
+        if self.executor is None:
+            future = Future()
+            future.set_result(_hash_many_job(passwords, self.n, self.r, self.p))
+            return future
+        return self.executor.submit(_hash_many_job, passwords, self.n, self.r, self.p)
+
+    def verify(self, password, stored):
+        """Devuelve (válida, necesita_rehash) para el hash almacenado"""
+        if not stored:
+            return False, False
+        valid, _ = self._run(_verify_job, password, stored)
+        return valid, valid and self.needs_rehash(stored)
+
+    def verify_dummy(self, password):
+        """Derivación completa que siempre falla: un username inexistente tarda lo mismo que uno real"""
+        self._run(_verify_job, password, self.dummy_hash)
+        return False
+
+    def needs_rehash(self, stored):
+        """Indica si el hash es SHA256 antiguo o usa otros parámetros de coste"""
+        return is_legacy_hash(stored) or not stored.startswith(f"scrypt${self.n}${self.r}${self.p}$")
+
+    def _run(self, job, *args):
+        """Ejecuta un trabajo en el pool y separa espera en cola y tiempo de hash"""
+        start = time.perf_counter()
+        if self.executor is None:
+            result, hash_time = job(*args)
+        else:
+            if not self.slots.acquire(timeout=self.queue_timeout):
+                with self.stats_lock:
+                    self.stats['rejected'] += 1
+                raise HasherBusyError("Demasiadas verificaciones de contraseña pendientes")
+            try:
+                result, hash_time = self.executor.submit(job, *args).result()
+            finally:
+                self.slots.release()
+        elapsed = time.perf_counter() - start
+        queue_wait = max(0.0, elapsed - hash_time)
+        TRACER.add_span(f"scrypt.{job.__name__.strip('_').removesuffix('_job')}", start, elapsed)
+
+        with self.stats_lock:
+            self.stats['jobs'] += 1
+            self.stats['queue_wait'] += queue_wait
+            self.stats['hash_time'] += hash_time
+            self.stats['queue_wait_max'] = max(self.stats['queue_wait_max'], queue_wait)
+            self.stats['hash_time_max'] = max(self.stats['hash_time_max'], hash_time)
+        return result, hash_time
+
+    def get_stats(self):
+        """Obtiene trabajos, rechazos y tiempos medios/máximos (ms) de cola y de hash"""
+        with self.stats_lock:
+            jobs = self.stats['jobs'] or 1
+            return {
+                'jobs': self.stats['jobs'],
+                'rejected': self.stats['rejected'],
+                'queue_wait_avg_ms': self.stats['queue_wait'] / jobs * 1000,
+                'queue_wait_max_ms': self.stats['queue_wait_max'] * 1000,
+                'hash_avg_ms': self.stats['hash_time'] / jobs * 1000,
+                'hash_max_ms': self.stats['hash_time_max'] * 1000
+            }
+
+    def close(self):
+        """Detiene los procesos del pool"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,116 @@
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+from datetime import datetime
+
+from rate_limiter import TokenBucketLimiter
+
+# Atributos propios de LogRecord: el resto son campos estructurados pasados con extra={...}
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro (ts, level, logger, msg y los campos de extra)"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class RateLimitFilter(logging.Filter):
+    """Limita cada tipo de mensaje (logger + plantilla) con un token bucket y cuenta los descartados"""
+
+    def __init__(self, rate=5.0, burst=20):
+        super().__init__()
+        self.limiter = TokenBucketLimiter(rate, burst, max_keys=1000)
+        self.lock = threading.Lock()
+        self.suppressed = {}  # {(logger, plantilla): descartados desde el último que pasó}
+        self.total_suppressed = 0
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        if not self.limiter.allow(key):
+            with self.lock:
+                self.suppressed[key] = self.suppressed.get(key, 0) + 1
+                self.total_suppressed += 1
+            return False
+        if self.suppressed:
+            with self.lock:
+                count = self.suppressed.pop(key, 0)
+            if count:
+                record.suppressed = count
+        return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Encola el registro sin formatear; con la cola llena lo descarta en lugar de bloquear la solicitud"""
+
+    def __init__(self, records):
+        super().__init__(records)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # El mensaje (msg % args) se construye en el hilo del listener, no en el de la solicitud
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_handler = None
+_listener = None
+_rate_filter = None
+
+def configure_logging(level='INFO', fmt='json', stream=None, queue_size=10000, rate=5.0, burst=20):
+    """Configura los loggers 'portal.*': cola acotada, filtro de ráfagas y escritura en un hilo aparte"""
+    global _handler, _listener, _rate_filter
+    stop_logging()
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    if fmt == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)-7s %(message)s'))
+
+    # Campos de LogRecord que no se escriben: no calcularlos en cada llamada
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    records = queue.Queue(maxsize=queue_size)
+    _rate_filter = RateLimitFilter(rate, burst)
+    _handler = NonBlockingQueueHandler(records)
+    _handler.addFilter(_rate_filter)
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+
+    logger = logging.getLogger('portal')
+    logger.handlers[:] = [_handler]
+    logger.setLevel(level)
+    logger.propagate = False
+
+def stop_logging():
+    """Escribe los registros pendientes y detiene el hilo de escritura"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def get_stats():
+    """Registros descartados por cola llena y por el límite de ráfagas"""
+    return {
+        'dropped': _handler.dropped if _handler is not None else 0,
+        'suppressed': _rate_filter.total_suppressed if _rate_filter is not None else 0
+    }
@@ -0,0 +1,306 @@
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from datetime import datetime, timedelta
+
+import portal_logging
+from auth_manager import AuthManager
+from firewall_manager import FirewallManager
+from neighbor_table import EMPTY_MAC
+from password_hasher import PasswordHasher
+from session_manager import SessionManagerBase, normalize_mac
+
+logger = logging.getLogger('portal.prefork')
+
+class SharedSessionManager(SessionManagerBase):
+    """Sesiones de un worker pre-fork: la tabla sessions (SQLite WAL) es la única fuente de verdad
+
+    No guarda sesiones en memoria ni toca el firewall o las expiraciones: cada escritura se
+    confirma al momento para que el resto de workers la vea, y el supervisor la aplica.
+    """
+
+    def __init__(self, auth_manager, session_writer, session_timeout=1800, neighbor_table=None):
+        super().__init__(neighbor_table)
+        self.auth_manager = auth_manager
+        # Sin hilo de escritura (flush_interval 0): el cambio está en la BD antes de responder
+        self.session_writer = session_writer
+        self.session_timeout = session_timeout
+        self.firewall_manager = None
+        self.firewall_queue = None
+
+    def _live_session(self, client_ip):
+        """(username, expiración, MAC) de la sesión vigente de una IP, o None"""
+        session_data = self.auth_manager.get_session_data(client_ip)
+        if not session_data:
+            return None
+        username, session_expire_str, mac = session_data
+        try:
+            expire_time = datetime.fromisoformat(session_expire_str)
+        except (ValueError, TypeError) as e:
+            logger.error("❌ SharedSessionManager Error parseando fecha: %s", e)
+            return None
+        if expire_time <= datetime.now():
+            return None  # El supervisor la cierra y la bloquea en su próximo ciclo
+        return username, expire_time, self._normalize_mac(mac)
+
+    def verify_active_session(self, client_ip):
+        """Verifica la sesión en la BD compartida y la MAC en la tabla de vecinos (sin caché entre workers)"""
+        session = self._live_session(client_ip)
+        if session is None:
+            return False
+        self._count('full_checks')
+        username, _, stored_mac = session
+        current_mac = self._normalize_mac(self.get_client_mac(client_ip))
+
+        if stored_mac == EMPTY_MAC and current_mac != EMPTY_MAC:
+            self.session_writer.update_mac(client_ip, current_mac)
+            return True
+        if stored_mac != EMPTY_MAC and current_mac != EMPTY_MAC and stored_mac != current_mac:
+            logger.warning("🚨 SharedSessionManager: Posible suplantación en %s (almacenada %s, actual %s)",
+                           client_ip, stored_mac, current_mac,
+                           extra={'event': 'spoofing', 'client_ip': client_ip,
+                                  'stored_mac': stored_mac, 'current_mac': current_mac})
+            self.end_session(client_ip, "suplantacion")
+            return False
+        return True
+
+    def verify_mac_integrity(self, client_ip, username):
+        """Rechaza el login si la IP tiene una sesión vigente ligada a otra MAC"""
+        session = self._live_session(client_ip)
+        if session is None:
+            return True
+        current_mac = self._normalize_mac(self.get_client_mac(client_ip))
+        stored_mac = session[2]
+        if stored_mac != EMPTY_MAC and current_mac != EMPTY_MAC and stored_mac != current_mac:
+            logger.warning("🚨 SharedSessionManager: Suplantación en BD para %s", client_ip,
+                           extra={'event': 'spoofing', 'client_ip': client_ip,
+                                  'stored_mac': stored_mac, 'current_mac': current_mac})
+            return False
+        return True
+
+    def create_session(self, client_ip, username, mac=None):
+        """Guarda la sesión; el supervisor la desbloquea en el firewall"""
+        normalized_mac = self._normalize_mac(mac) if mac else EMPTY_MAC
+        now = datetime.now()
+        expire = now + timedelta(seconds=self.session_timeout)
+        self.session_writer.save_session(client_ip, username, normalized_mac, now.isoformat(),
+                                         expire.isoformat(), 1)
+        logger.info("✅ SharedSessionManager: Sesión creada para %s (%s), MAC %s, expira %s",
+                    username, client_ip, normalized_mac, expire,
+                    extra={'event': 'session_start', 'client_ip': client_ip, 'username': username,
+                           'pid': os.getpid()})
+        return True
+
+    def end_session(self, client_ip, reason="timeout", session_id=None):
+        """Marca la sesión como cerrada; el supervisor aplica el bloqueo"""
+        session = self._live_session(client_ip)
+        if session is None:
+            logger.debug("⚠️  SharedSessionManager: No hay sesión activa para %s", client_ip)
+            return
+        self.session_writer.set_liberated(client_ip, 0)
+        logger.info("⏰ SharedSessionManager: Sesión terminada para %s (%s) - Razón: %s",
+                    session[0], client_ip, reason,
+                    extra={'event': 'session_end', 'client_ip': client_ip, 'username': session[0],
+                           'reason': reason, 'pid': os.getpid()})
+
+    def get_session_info(self, client_ip):
+        """Obtiene información de una sesión desde la BD compartida"""
+        session = self._live_session(client_ip)
+        if session is None:
+            return None
+        username, expire_time, mac = session
+        expiry = expire_time.timestamp()
+        return {
+            'username': username,
+            'mac': mac,
+            'remaining': max(0, expiry - time.time()),
+            'expiry': expiry,
+            'firewall': 'supervisor'
+        }
+
+class FirewallReconciler:
+    """Lleva el firewall al estado de la tabla sessions que escriben los workers (un único dueño)"""
+
+    def __init__(self, auth_manager, firewall_manager):
+        self.auth_manager = auth_manager
+        self.firewall_manager = firewall_manager
+        self.applied = {}  # {ip: MAC} autorizadas por este proceso
+        self.data_version = None
+        self.stats = {'reconciles': 0, 'allowed': 0, 'denied': 0, 'failed': 0}
+
+    def tick(self):
+        """Cierra las sesiones vencidas y, si algún worker escribió desde el último ciclo, reconcilia"""
+        expired = self.auth_manager.clean_expired_sessions()
+        # data_version sólo cambia con commits de otras conexiones: sin cambios no hay consulta
+        version = self.auth_manager.data_version()
+        if expired or version != self.data_version:
+            self.data_version = version
+            self.reconcile()
+
+    def reconcile(self):
+        """Autoriza las sesiones vigentes que faltan y bloquea las que ya no lo están, en un solo lote"""
+        live = {client_ip: normalize_mac(mac) for client_ip, _, _, mac in self.auth_manager.get_live_sessions()}
+        ops = [('deny', client_ip, None) for client_ip in self.applied if client_ip not in live]
+        # Con parejas IP+MAC, una sesión sin MAC espera a que el worker la aprenda (update_mac
+        # cambia data_version y dispara otro ciclo); reintentarla en cada ciclo no serviría de nada
+        ops += [('allow', client_ip, mac) for client_ip, mac in live.items()
+                if (client_ip not in self.applied or self.applied[client_ip] != mac)
+                and not (self.firewall_manager.requires_mac and mac == EMPTY_MAC)]
+        self.stats['reconciles'] += 1
+        if not ops:
+            return True
+
+        results = self.firewall_manager.apply_batch(ops)
+        allowed = denied = failed = 0
+        for action, client_ip, mac in ops:
+            if not results.get(client_ip):
+                failed += 1  # applied no cambia: la diferencia se vuelve a calcular
+            elif action == 'allow':
+                self.applied[client_ip] = mac
+                allowed += 1
+            else:
+                self.applied.pop(client_ip, None)
+                denied += 1
+        self.stats['allowed'] += allowed
+        self.stats['denied'] += denied
+        self.stats['failed'] += failed
+        logger.info("🧱 FirewallReconciler: %d autorizadas, %d bloqueadas (%d sesiones vigentes)",
+                    allowed, denied, len(self.applied))
+        if failed:
+            # Se reintenta en el próximo ciclo aunque nadie vuelva a escribir
+            logger.error("❌ FirewallReconciler: %d operaciones fallidas, se reintentarán", failed)
+            self.data_version = None
+            return False
+        return True
+
+def worker_path(path, index):
+    """Fichero propio de un worker ('traces.jsonl' -> 'traces-1.jsonl'): la rotación no se comparte"""
+    root, ext = os.path.splitext(path)
+    return f"{root}-{index}{ext}"
+
+def worker_limits(options, processes):
+    """Reparte entre los workers los límites de 429 de cada uno
+
+    Cada worker guarda sus propios token buckets y el kernel reparte las conexiones de un mismo
+    cliente entre todos: con el límite completo en cada worker el cliente tendría N veces el
+    configurado. El burst no baja de 1 para que un worker nunca rechace todos los intentos.
+    """
+    return dict(options,
+                login_rate=options.get('login_rate', 1.0) / processes,
+                login_burst=max(1, options.get('login_burst', 10) / processes),
+                user_login_rate=options.get('user_login_rate', 0.2) / processes,
+                user_login_burst=max(1, options.get('user_login_burst', 5) / processes))
+
+def run_worker(options, index, log_level, log_format):
+    """Proceso worker: HotspotServer con SO_REUSEPORT y sesiones compartidas en SQLite"""
+    from server import HotspotServer
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    portal_logging.configure_logging(log_level, log_format)
+    options = dict(options, shared_sessions=True, reuse_port=True)
+    if options.get('trace_file'):
+        options['trace_file'] = worker_path(options['trace_file'], index)
+
+    server = HotspotServer(**options)
+    signal.signal(signal.SIGUSR1, lambda signum, frame: server.start_profile())
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+class PreforkSupervisor:
+    """Proceso padre del modo pre-fork: lanza N workers y es el único que aplica firewall y expiraciones"""
+
+    def __init__(self, options, processes=4, firewall_runner=None, interval=0.2,
+                 log_level='INFO', log_format='json'):
+        self.options = options  # Argumentos de HotspotServer para cada worker
+        self.processes = processes
+        self.worker_options = worker_limits(options, processes)
+        self.firewall_runner = firewall_runner
+        self.interval = interval  # Segundos entre ciclos de reconciliación
+        self.log_level = log_level
+        self.log_format = log_format
+        # spawn: los workers arrancan limpios, sin heredar hilos, locks ni conexiones SQLite del padre
+        self.context = multiprocessing.get_context('spawn')
+        self.workers = {}  # {índice: Process}
+        self.restarts = 0
+        self.stopping = False
+
+    def start_worker(self, index):
+        process = self.context.Process(target=run_worker, name=f"hotspot-worker-{index}",
+                                       args=(self.worker_options, index, self.log_level, self.log_format))
+        process.start()
+        self.workers[index] = process
+        logger.info("👷 PreforkSupervisor: Worker %d arrancado (pid %d)", index, process.pid)
+
+    def check_workers(self):
+        """Relanza los workers que murieron inesperadamente"""
+        for index, process in list(self.workers.items()):
+            if not process.is_alive() and not self.stopping:
+                logger.error("❌ PreforkSupervisor: Worker %d (pid %d) terminó con código %s, relanzando",
+                             index, process.pid, process.exitcode)
+                self.restarts += 1
+                self.start_worker(index)
+
+    def signal_workers(self, signum):
+        for process in self.workers.values():
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    def stop_workers(self, timeout=10.0):
+        """SIGTERM a los workers (escriben lo pendiente al salir) y espera a que terminen"""
+        self.stopping = True
+        self.signal_workers(signal.SIGTERM)
+        deadline = time.monotonic() + timeout
+        for process in self.workers.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+    def run(self):
+        """Migra la BD, restaura el firewall, lanza los workers y reconcilia hasta que se interrumpa"""
+        # Las migraciones se aplican aquí, antes de que ningún worker abra la BD
+        auth_manager = AuthManager(busy_timeout=self.options.get('db_busy_timeout', 5.0),
+                                   hasher=PasswordHasher(workers=0))
+        scripts_dir = os.path.dirname(os.path.abspath(__file__))
+        firewall_manager = FirewallManager(scripts_dir, backend=self.options.get('firewall_backend', 'script'),
+                                           runner=self.firewall_runner,
+                                           ipset_name=self.options.get('ipset_name', 'portal_allowed'),
+                                           ipset_mac=self.options.get('ipset_mac', False))
+        reconciler = FirewallReconciler(auth_manager, firewall_manager)
+
+        # config.sh vacía iptables al arrancar: las sesiones vigentes se reautorizan en un único lote
+        auth_manager.clean_expired_sessions()
+        reconciler.data_version = auth_manager.data_version()
+        reconciler.reconcile()
+
+        # kill -USR1 al supervisor perfila todos los workers
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.signal_workers(signal.SIGUSR1))
+        for index in range(self.processes):
+            self.start_worker(index)
+        logger.info("🚀 SERVIDOR HOTSPOT INICIADO (pre-fork): %d workers en %s:%d, firewall %s",
+                    self.processes, self.options.get('host', '192.168.100.1'), self.options.get('port', 8000),
+                    firewall_manager.backend.name,
+                    extra={'event': 'start', 'mode': 'prefork', 'processes': self.processes})
+
+        try:
+            while True:
+                time.sleep(self.interval)
+                try:
+                    reconciler.tick()
+                except Exception as e:
+                    logger.error("❌ PreforkSupervisor Error reconciliando sesiones: %s", e)
+                self.check_workers()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            logger.info("🛑 PreforkSupervisor: Deteniendo workers...")
+            self.stop_workers()
+            auth_manager.close()
+            portal_logging.stop_logging()
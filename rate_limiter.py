@@ -0,0 +1,84 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+class TokenBucketLimiter:
+    """Un token bucket por clave; las claves menos usadas se descartan al superar max_keys (LRU)"""
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate  # Tokens por segundo
+        self.burst = burst  # Solicitudes seguidas permitidas con el bucket lleno
+        self.max_keys = max_keys  # Cota de memoria ante una inundación de IPs falsificadas
+        self.buckets = OrderedDict()  # {clave: [tokens, último instante]}
+        self.lock = threading.Lock()
+        self.evicted = 0
+
+    def allow(self, key, now=None):
+        """Consume un token de la clave; devuelve False si el bucket está vacío"""
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.max_keys:
+                    self.buckets.popitem(last=False)
+                    self.evicted += 1
+                bucket = self.buckets[key] = [self.burst, now]
+            else:
+                self.buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] < 1:
+                return False
+            bucket[0] -= 1
+            return True
+
+    def __len__(self):
+        return len(self.buckets)
+
+class RequestThrottle:
+    """Limita los POST de login/registro por IP y por username antes de tocar SQLite o scrypt"""
+
+    def __init__(self, ip_rate=1.0, ip_burst=10, user_rate=0.2, user_burst=5, max_keys=10000):
+        self.by_ip = TokenBucketLimiter(ip_rate, ip_burst, max_keys)
+        self.by_user = TokenBucketLimiter(user_rate, user_burst, max_keys)
+        self.stats_lock = threading.Lock()
+        self.stats = {'checked': 0, 'throttled_ip': 0, 'throttled_user': 0}
+
+    def allow_ip(self, client_ip):
+        """Consume un intento de la IP (se consulta primero: no requiere parsear el cuerpo)"""
+        self._count('checked')
+        if self.by_ip.allow(client_ip):
+            return True
+        self._count('throttled_ip')
+        return False
+
+    def allow_user(self, username):
+        """Consume un intento del username (frena ataques a una cuenta desde muchas IPs)"""
+        if not username:
+            return True
+        # Clave de tamaño fijo: un username puede ocupar todo el cuerpo (64 KB) y el LRU no acotaría memoria
+        key = hashlib.blake2b(username.encode('utf-8', errors='ignore'), digest_size=16).digest()
+        if self.by_user.allow(key):
+            return True
+        self._count('throttled_user')
+        return False
+
+    def allow(self, client_ip, username=None):
+        """Indica si la solicitud puede pasar ambos límites"""
+        return self.allow_ip(client_ip) and self.allow_user(username)
+
+    def _count(self, name):
+        with self.stats_lock:
+            self.stats[name] += 1
+
+    def get_stats(self):
+        """Obtiene solicitudes revisadas, rechazadas por IP/username y claves en memoria"""
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats['allowed'] = stats['checked'] - stats['throttled_ip'] - stats['throttled_user']
+        stats['tracked_ips'] = len(self.by_ip)
+        stats['tracked_users'] = len(self.by_user)
+        stats['evicted'] = self.by_ip.evicted + self.by_user.evicted
+        return stats
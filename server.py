@@ -1,132 +1,407 @@
+import argparse
+import logging
+import queue
+import signal
 import socket
+import sys
 import threading
+import time
 import subprocess
 import os
-import re
-from urllib.parse import parse_qs
+from urllib.parse import parse_qs, urlsplit
 
 # Importar los managers
 from auth_manager import AuthManager
 from session_manager import NetworkSessionManager
 from firewall_manager import FirewallManager
+from password_hasher import PasswordHasher
+from session_writer import SessionWriter
+from http_parser import HttpRequestParser, HttpError, error_response
+from asset_cache import AssetCache
+from templates import TemplateCache, portal_template
+from rate_limiter import RequestThrottle
+from idle_watcher import IdleWatcher
+from metrics import REGISTRY
+from tracing import TRACER, StackSampler
+import portal_logging
+
+logger = logging.getLogger('portal.server')
+
+# Respuesta precalculada para descartar conexiones cuando la cola está llena
+SHED_BODY = "Servidor ocupado, inténtalo de nuevo en unos segundos".encode()
+SHED_RESPONSE = (
+    "HTTP/1.1 503 Service Unavailable\r\n"
+    "Content-Type: text/plain; charset=utf-8\r\n"
+    f"Content-Length: {len(SHED_BODY)}\r\n"
+    "Retry-After: 2\r\n"
+    "Connection: close\r\n"
+    "\r\n"
+).encode() + SHED_BODY
+
+# Respuesta precalculada para los POST que superan el límite de intentos (sin tocar la BD)
+THROTTLED_BODY = "Demasiados intentos, espera unos segundos".encode()
+THROTTLED_HEAD = (
+    "HTTP/1.1 429 Too Many Requests\r\n"
+    "Content-Type: text/plain; charset=utf-8\r\n"
+    f"Content-Length: {len(THROTTLED_BODY)}\r\n"
+    "Retry-After: 5\r\n"
+).encode()
+
+# Rutas conocidas como etiqueta de métricas (las demás cuentan como 'other' para acotar las series)
+ROUTES = {'/': 'portal', '/styles.css': 'styles.css', '/login': 'login', '/register': 'register',
+          '/logout': 'logout', '/status': 'status', '/metrics': 'metrics', '/debug/profile': 'profile'}
+REQUEST_SECONDS = REGISTRY.histogram('portal_request_seconds',
+                                     'Tiempo en construir la respuesta por método y ruta', ['method', 'route'])
+ACTIVE_CONNECTIONS = REGISTRY.gauge('portal_active_connections', 'Conexiones HTTP atendiéndose ahora')
+
+# Fragmentos precalculados que se insertan en las plantillas
+REGISTER_OK = '<div class="alert success">¡Registro exitoso!</div>'.encode()
+REGISTER_ERROR = '<div class="alert error">Usuario ya existe o error en el registro.</div>'.encode()
+LOGIN_ERROR = '<div class="alert error">Credenciales incorrectas. Inténtalo de nuevo.</div>'.encode()
+UNLOCK_ERROR = '<div class="alert error">✅ Login exitoso, pero error al liberar acceso. Contacta al administrador.</div>'.encode()
+LOGOUT_OK = '<div class="alert success">✅ Sesión cerrada exitosamente</div>'.encode()
+ALREADY_LOGGED_OUT = '<div class="alert success">✅ Ya has cerrado sesión</div>'.encode()
+OPEN_REGISTER_TAB = """
+        <script>
+            document.addEventListener('DOMContentLoaded', function() {
+                openTab('register');
+            });
+        </script>
+        """.encode()
+ERROR_PAGE = """
+            <!DOCTYPE html>
+            <html>
+            <head><title>Error</title></head>
+            <body>
+                <h1>Portal de Acceso Hotspot</h1>
+                <p>Error cargando la página</p>
+            </body>
+            </html>
+            """.encode()
 
 class HotspotServer:
-    def __init__(self):
-        self.host = '192.168.100.1'  # IP de la interfaz virtual
-        self.port = 8000
+    def __init__(self, host='192.168.100.1', port=8000, backlog=128, mode='threaded', workers=8, auth_workers=4,
+                 pool_size=32, queue_depth=256, keepalive_timeout=5, max_keepalive_requests=100,
+                 db_busy_timeout=5.0, hash_workers=2, neighbor_table=None, mac_check_ttl=10,
+                 firewall_backend='script', ipset_name='portal_allowed', ipset_mac=False,
+                 firewall_runner=None, db_flush_interval=0.05, db_flush_ops=256,
+                 session_timeout=1800, login_rate=1.0, login_burst=10, user_login_rate=0.2, user_login_burst=5,
+                 metrics_allow=(), trace_sample_rate=0.0, trace_file='traces.jsonl',
+                 profile_dir='.', profile_seconds=10.0, shared_sessions=False, reuse_port=False):
+        self.host = host  # IP de la interfaz virtual
+        self.port = port
+        self.backlog = backlog  # Conexiones pendientes en listen()
+        self.reuse_port = reuse_port  # SO_REUSEPORT: varios procesos escuchan en el mismo puerto (pre-fork)
+        self.shared_sessions = shared_sessions  # Worker pre-fork: sesiones en SQLite, firewall en el supervisor
+        self.mode = mode  # 'threaded' o 'event-loop'
+        self.workers = workers  # Hilos del executor para trabajo bloqueante (modo event-loop)
+        self.auth_workers = auth_workers  # Hilos aparte para login/registro (modo event-loop)
+        self.pool_size = pool_size  # Hilos fijos que atienden conexiones (modo threaded)
+        self.queue_depth = queue_depth  # Conexiones aceptadas en espera de un hilo libre
+        self.accept_queue = queue.Queue(maxsize=queue_depth)
+        self.pool_lock = threading.Lock()
+        self.busy_workers = 0
+        self.accepted_count = 0
+        self.shed_count = 0
+        self.keepalive_timeout = keepalive_timeout  # Segundos de inactividad antes de cerrar
+        # Las conexiones keep-alive inactivas esperan en un selector, no ocupando un hilo del pool
+        self.idle_watcher = IdleWatcher(self.resume_connection, timeout=keepalive_timeout)
+        self.max_keepalive_requests = max_keepalive_requests  # Solicitudes por conexión
         self.scripts_dir = os.path.dirname(os.path.abspath(__file__))
+        self.assets = AssetCache(self.scripts_dir)
+        self.templates = TemplateCache(self.assets, {'portal.html': portal_template})
+        # Intentos de login/registro por IP y por username (token buckets con memoria acotada)
+        self.throttle = RequestThrottle(ip_rate=login_rate, ip_burst=login_burst,
+                                        user_rate=user_login_rate, user_burst=user_login_burst)
+        self.throttled_responses = {
+            keep_alive: THROTTLED_HEAD + self.connection_header(keep_alive).encode() + b"\r\n" + THROTTLED_BODY
+            for keep_alive in (True, False)
+        }
         
         # Inicializar managers
-        self.auth_manager = AuthManager()
-        self.firewall_manager = FirewallManager(self.scripts_dir)
-        self.session_manager = NetworkSessionManager(self.auth_manager,firewall_manager=self.firewall_manager)
+        self.auth_manager = AuthManager(busy_timeout=db_busy_timeout,
+                                        hasher=PasswordHasher(workers=hash_workers))
+        if shared_sessions:
+            # Otros workers leen la sesión en cuanto se responde: escritura síncrona, sin caché en memoria
+            from prefork import SharedSessionManager
+            self.firewall_manager = None
+            self.session_writer = SessionWriter(self.auth_manager, flush_interval=0)
+            self.session_manager = SharedSessionManager(self.auth_manager, self.session_writer,
+                                                        session_timeout=session_timeout,
+                                                        neighbor_table=neighbor_table)
+        else:
+            self.firewall_manager = FirewallManager(self.scripts_dir, backend=firewall_backend,
+                                                    runner=firewall_runner, ipset_name=ipset_name,
+                                                    ipset_mac=ipset_mac)
+            # db_flush_interval: segundos de cambios de sesión que pueden perderse si el proceso muere
+            self.session_writer = SessionWriter(self.auth_manager, flush_interval=db_flush_interval,
+                                                max_ops=db_flush_ops)
+            self.session_manager = NetworkSessionManager(self.auth_manager,firewall_manager=self.firewall_manager,
+                                                         session_timeout=session_timeout,
+                                                         neighbor_table=neighbor_table,
+                                                         mac_check_ttl=mac_check_ttl,
+                                                         session_writer=self.session_writer)
+        
+        # /metrics sólo responde al propio gateway (y a las IPs de administración indicadas)
+        self.metrics_allow = {'127.0.0.1', '::1', self.host, *metrics_allow}
+        self.register_metrics()
+        
+        # Trazas por fase de una fracción de las solicitudes y perfiles bajo demanda (SIGUSR1 o /debug/profile)
+        if trace_sample_rate > 0:
+            TRACER.configure(trace_file, trace_sample_rate)
+        self.profiler = StackSampler(profile_dir)
+        self.profile_seconds = profile_seconds
+    
+    def register_metrics(self):
+        """Expone en /metrics los contadores que ya mantienen los componentes (se leen al exportar)"""
+        if self.shared_sessions:
+            # Sin caché por worker: se cuentan en la BD compartida (la misma cifra en todos los workers)
+            REGISTRY.callback('portal_active_sessions', 'Sesiones activas en la BD compartida',
+                              lambda: self.auth_manager.count_live_sessions())
+        else:
+            REGISTRY.callback('portal_active_sessions', 'Sesiones activas en memoria',
+                              lambda: len(self.session_manager.active_sessions))
+            REGISTRY.callback('portal_firewall_queue_pending', 'Operaciones de firewall sin aplicar',
+                              lambda: self.session_manager.firewall_queue.get_stats()['pending'])
+        REGISTRY.callback('portal_pool_busy_workers', 'Hilos del pool atendiendo una conexión',
+                          lambda: self.busy_workers)
+        REGISTRY.callback('portal_accept_queue_length', 'Conexiones aceptadas esperando un hilo',
+                          lambda: self.accept_queue.qsize())
+        REGISTRY.callback('portal_idle_connections', 'Conexiones keep-alive inactivas fuera del pool',
+                          lambda: len(self.idle_watcher))
+        REGISTRY.callback('portal_connections_shed_total', 'Conexiones rechazadas con 503 por cola llena',
+                          lambda: self.shed_count, type='counter')
+        REGISTRY.callback('portal_throttled_requests_total', 'POST de login/registro rechazados con 429',
+                          lambda: {reason: self.throttle.get_stats()[f'throttled_{reason}']
+                                   for reason in ('ip', 'user')},
+                          type='counter', labelnames=['by'])
+        REGISTRY.callback('portal_mac_verifications_total', 'Verificaciones de sesión por camino',
+                          lambda: self.session_manager.get_verification_stats(),
+                          type='counter', labelnames=['path'])
+        REGISTRY.callback('portal_session_writes_pending', 'Cambios de sesión sin escribir en SQLite',
+                          lambda: self.session_writer.get_stats()['pending'])
+        REGISTRY.callback('portal_log_records_dropped_total', 'Registros de log descartados por motivo',
+                          lambda: {'queue_full': portal_logging.get_stats()['dropped'],
+                                   'rate_limited': portal_logging.get_stats()['suppressed']},
+                          type='counter', labelnames=['reason'])
+    
+    def metrics_response(self, connection):
+        """Respuesta de /metrics en formato de texto de Prometheus"""
+        body = REGISTRY.render().encode()
+        headers = (
+            "HTTP/1.1 200 OK\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"{connection}"
+            "\r\n"
+        )
+        return headers.encode() + body
+    
+    def start_profile(self, seconds=None):
+        """Arranca una ventana de muestreo de pilas; devuelve la ruta del perfil o None si ya hay una"""
+        seconds = seconds or self.profile_seconds
+        path = self.profiler.start(seconds)
+        if path is None:
+            logger.warning("⚠️ HotspotServer: Ya hay un perfil en curso")
+        else:
+            logger.info("🔬 HotspotServer: Perfilando %.0f s -> %s", seconds, path)
+        return path
+    
+    def profile_response(self, request, connection):
+        """Respuesta de /debug/profile?seconds=N: el perfil se escribe en disco al terminar la ventana"""
+        seconds = parse_qs(urlsplit(request.path).query).get('seconds', [''])[0]
+        try:
+            seconds = min(max(float(seconds), 1.0), 300.0) if seconds else None
+        except ValueError:
+            seconds = None
+        path = self.start_profile(seconds)
+        if path is None:
+            status, body = "409 Conflict", "Ya hay un perfil en curso"
+        else:
+            status, body = "202 Accepted", f"Perfil en curso: {path}"
+        body = body.encode()
+        headers = (
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"{connection}"
+            "\r\n"
+        )
+        return headers.encode() + body
         
     
     def unlock_client(self, client_ip, username):
         """Libera un cliente usando el session manager"""
-        print(f"🔓 HotspotServer: Intentando liberar cliente: {client_ip}")
+        logger.debug("🔓 HotspotServer: Intentando liberar cliente: %s", client_ip)
         
         # Verificar integridad MAC
         if not self.session_manager.verify_mac_integrity(client_ip, username):
-            print(f"❌ HotspotServer: Bloqueado por posible suplantación: {client_ip}")
+            logger.warning("❌ HotspotServer: Bloqueado por posible suplantación: %s", client_ip,
+                           extra={'client_ip': client_ip, 'username': username})
             return False
         
-        # Ejecutar script de desbloqueo a traves de firewall manager
-        success = self.firewall_manager.unlock_client(client_ip)
+        # Obtener MAC del cliente (el backend ipset puede autorizar la pareja IP+MAC)
+        mac = self.session_manager.get_client_mac(client_ip)
         
-        if success:
-            # Obtener MAC del cliente
-            mac = self.session_manager.get_client_mac(client_ip)
-            
-            # Crear sesión
-            session_created = self.session_manager.create_session(client_ip, username, mac)
-            
-            if session_created:
-                print(f"✅ HotspotServer: Cliente {client_ip} liberado exitosamente")
-                return True
-            else:
-                print(f"❌ HotspotServer: Error creando sesión para {client_ip}")
-                return False
+        # Crear sesión: el desbloqueo en el firewall se encola y no retrasa la respuesta
+        session_created = self.session_manager.create_session(client_ip, username, mac)
+        
+        if session_created:
+            logger.debug("✅ HotspotServer: Cliente %s liberado exitosamente", client_ip)
+            return True
         else:
-            print(f"❌ HotspotServer: Error ejecutando unlock.sh para {client_ip}")
+            logger.error("❌ HotspotServer: Error creando sesión para %s", client_ip)
             return False
     
     def block_client(self, client_ip, reason="timeout"):
         """Bloquea un cliente"""
-        print(f"⏰ HotspotServer: Bloqueando cliente {client_ip} - Razón: {reason}")
+        logger.debug("⏰ HotspotServer: Bloqueando cliente %s - Razón: %s", client_ip, reason)
         
-        success = self.firewall_manager.block_client(client_ip)
+        # end_session encola el bloqueo en el firewall
+        self.session_manager.end_session(client_ip, reason)
+        logger.debug("✅ HotspotServer: Cliente %s bloqueado", client_ip)
+        return True
+    
+    def connection_header(self, keep_alive):
+        """Cabecera Connection (y Keep-Alive) de una respuesta"""
+        if keep_alive:
+            return f"Connection: keep-alive\r\nKeep-Alive: timeout={self.keepalive_timeout}\r\n"
+        return "Connection: close\r\n"
+    
+    def throttle_response(self, request, client_ip, keep_alive=False):
+        """Devuelve el 429 precalculado si un POST de login/registro supera el límite, o None"""
+        if request.method != 'POST':
+            return None
+        # El cuerpo sólo se parsea si la IP aún tiene intentos
+        if self.throttle.allow_ip(client_ip):
+            username = parse_qs(request.body.decode('utf-8', errors='ignore')).get('username', [''])[0]
+            if self.throttle.allow_user(username):
+                return None
+        return self.throttled_responses[keep_alive]
+    
+    def build_response(self, request, client_ip, keep_alive=False, throttle=True):
+        """Construye la respuesta HTTP completa (bytes) para una solicitud"""
+        start = time.perf_counter()
+        method = request.method if request.method in ('GET', 'POST') else 'other'
+        route = ROUTES.get(request.path, 'other')
+        # La traza empieza al parsear: entre 'parse' y la siguiente fase queda la espera en cola/executor
+        traced = TRACER.begin('request', start=start - request.parse_seconds,
+                              method=method, route=route, client_ip=client_ip)
+        if traced:
+            TRACER.add_span('parse', start - request.parse_seconds, request.parse_seconds)
+        response = None
+        try:
+            response = self.route_request(request, client_ip, keep_alive, throttle)
+            return response
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method, route)
+            if traced:
+                TRACER.end(status=int(response[9:12]) if response else 500)
+    
+    def route_request(self, request, client_ip, keep_alive, throttle):
+        connection = self.connection_header(keep_alive)
         
-        if success:
-            self.session_manager.end_session(client_ip, reason)
-            print(f"✅ HotspotServer: Cliente {client_ip} bloqueado")
-            return True
-        else:
-            print(f"❌ HotspotServer: Error bloqueando cliente {client_ip}")
-            return False
+        # Fuera de la lista permitida /metrics se trata como cualquier otra ruta (portal)
+        if request.path == '/metrics' and client_ip in self.metrics_allow:
+            return self.metrics_response(connection)
+        if request.path.startswith('/debug/profile') and client_ip in self.metrics_allow:
+            return self.profile_response(request, connection)
+        
+        # Servir archivos estáticos
+        if request.path == '/styles.css':
+            return self.file_response('styles.css', 'text/css; charset=utf-8', request.headers, connection)
+        
+        if throttle:
+            throttled = self.throttle_response(request, client_ip, keep_alive)
+            if throttled is not None:
+                return throttled
+        
+        response_body = self.process_request(request.method, request.path, request.data, client_ip)
+        headers = (
+            "HTTP/1.1 200 OK\r\n"
+            "Content-Type: text/html; charset=utf-8\r\n"
+            f"Content-Length: {len(response_body)}\r\n"
+            f"{connection}"
+            "\r\n"
+        )
+        return headers.encode() + response_body
     
-    def handle_request(self, conn, addr):
-        """Maneja solicitudes HTTP"""
+    def handle_request(self, conn, addr, state=None):
+        """Maneja solicitudes HTTP (varias por conexión si el cliente usa keep-alive)"""
+        # state: (parser, servidas) de una conexión keep-alive que vuelve del IdleWatcher
+        parser, served = state or (HttpRequestParser(), 0)
+        idle = False
         try:
-            data = conn.recv(4096).decode('utf-8', errors='ignore')
-            if not data:
-                return
-            
-            lines = data.split('\n')
-            first_line = lines[0] if lines else ''
-            parts = first_line.split(' ')
-            
-            if len(parts) < 2:
-                return
-            
-            method = parts[0]
-            path = parts[1]
-            client_ip = addr[0]
-            
-            # Servir archivos estáticos
-            if path == '/styles.css':
-                self.serve_file(conn, 'styles.css', 'text/css')
-                return
-            
-            response_body = self.process_request(method, path, data, client_ip)
-            
-            http_response = f"""HTTP/1.1 200 OK
-Content-Type: text/html; charset=utf-8
-Content-Length: {len(response_body)}
-
-{response_body}"""
-            
-            conn.sendall(http_response.encode())
+            conn.settimeout(10)
+            while True:
+                request = parser.next_request()
+                if request is None:
+                    if idle:
+                        # Sin solicitud pendiente: la espera se hace en el selector y el hilo queda libre
+                        self.idle_watcher.park(conn, addr, (parser, served))
+                        conn = None
+                        return
+                    data = conn.recv(65536)
+                    if not data:
+                        return
+                    parser.feed(data)
+                    continue
+                
+                served += 1
+                # Con clientes esperando en la cola se cierra la conexión para liberar el hilo
+                keep_alive = (request.keep_alive and
+                              served < self.max_keepalive_requests and
+                              self.accept_queue.empty())
+                conn.sendall(self.build_response(request, addr[0], keep_alive))
+                if not keep_alive:
+                    return
+                idle = True
             
+        except HttpError as e:
+            try:
+                conn.sendall(error_response(e.status))
+            except OSError:
+                pass
+        except socket.timeout:
+            pass
         except Exception as e:
-            print(f"❌ HotspotServer Error en handle_request: {e}")
+            logger.error("❌ HotspotServer Error en handle_request: %s", e)
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
+    
+    def resume_connection(self, conn, addr, state):
+        """Devuelve a la cola del pool una conexión keep-alive que recibió datos"""
+        try:
+            self.accept_queue.put_nowait((conn, addr, state))
+        except queue.Full:
+            self.shed_connection(conn)
      
        
-    def serve_file(self, conn, filename, content_type):
-        """Sirve archivos estáticos"""
+    def file_response(self, filename, content_type, headers=None, connection="Connection: close\r\n"):
+        """Construye la respuesta HTTP para un archivo estático (desde la caché en memoria)"""
         try:
-            file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            response = f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\n\r\n{content}"
-            conn.sendall(response.encode())
+            return self.assets.response(filename, content_type, headers or {}, connection)
         except Exception as e:
-            print(f"❌ Error sirviendo archivo {filename}: {e}")
-            response = "HTTP/1.1 404 Not Found\r\n\r\nArchivo no encontrado"
-            conn.sendall(response.encode())
+            logger.error("❌ Error sirviendo archivo %s: %s", filename, e)
+            return b"HTTP/1.1 404 Not Found\r\nContent-Length: 21\r\nConnection: close\r\n\r\nArchivo no encontrado"
+    
+    def serve_file(self, conn, filename, content_type):
+        """Sirve archivos estáticos"""
+        conn.sendall(self.file_response(filename, content_type))
         
     def process_request(self, method, path, data, client_ip):
-        """Procesa solicitudes HTTP"""
+        """Procesa solicitudes HTTP y devuelve el cuerpo HTML (bytes)"""
         if path == '/styles.css':
             return None 
         
         # Verificar sesión activa
-        if self.session_manager.verify_active_session(client_ip):
+        with TRACER.span('verify_active_session'):
+            active = self.session_manager.verify_active_session(client_ip)
+        if active:
             if path == '/logout':
                 self.block_client(client_ip, reason="logout")
-                return self.message_success("✅ Sesión cerrada exitosamente") + self.serve_html('portal.html')
+                return LOGOUT_OK + self.render_portal()
             elif path == '/status':
                 return self.success_page(client_ip)
             else:
@@ -135,14 +410,14 @@ Content-Length: {len(response_body)}
         # Si no tiene sesión activa, mostrar portal
         if method == 'GET':
             if path == '/register':
-                return self.serve_html('portal.html')
+                return self.render_portal()
             elif path == '/logout':
-                return self.message_success("✅ Ya has cerrado sesión") + self.serve_html('portal.html')
+                return ALREADY_LOGGED_OUT + self.render_portal()
             else:
-                return self.serve_html('portal.html')
+                return self.render_portal()
         
         elif method == 'POST':
-            body = data.split('\r\n\r\n')[1] if '\r\n\r\n' in data else ''
+            body = data.split('\r\n\r\n', 1)[1] if '\r\n\r\n' in data else ''
             params = parse_qs(body)
             
             username = params.get('username', [''])[0]
@@ -150,20 +425,13 @@ Content-Length: {len(response_body)}
             
             if path == '/register':
                 if self.auth_manager.register_user(username, password):
-                    html = self.serve_html('portal.html')
-                    html = self.inject_message(html, 
-                        '<div class="alert success">¡Registro exitoso!</div>',
-                        'register')
-                    return html
+                    return self.render_portal(register_message=REGISTER_OK)
                 else:
-                    html = self.serve_html('portal.html')
-                    html = self.inject_message(html,
-                        '<div class="alert error">Usuario ya existe o error en el registro.</div>',
-                        'register')
-                    return html
+                    return self.render_portal(register_message=REGISTER_ERROR)
             else:  # login
                 if self.auth_manager.verify_login(username, password):
-                    print(f"👤 HotspotServer: Login exitoso: {username} desde {client_ip}")
+                    logger.info("👤 HotspotServer: Login exitoso: %s desde %s", username, client_ip,
+                                extra={'event': 'login', 'client_ip': client_ip, 'username': username})
                     
                     # Liberar al cliente
                     liberation_success = self.unlock_client(client_ip, username)
@@ -171,72 +439,25 @@ Content-Length: {len(response_body)}
                     if liberation_success:
                         return self.success_page(client_ip)
                     else:
-                        html = self.serve_html('portal.html')
-                        html = self.inject_message(html,
-                            '<div class="alert error">✅ Login exitoso, pero error al liberar acceso. Contacta al administrador.</div>',
-                            'login')
-                        return html
+                        return self.render_portal(login_message=UNLOCK_ERROR)
                 else:
-                    print(f"❌ HotspotServer: Login fallido: {username} desde {client_ip}")
-                    html = self.serve_html('portal.html')
-                    html = self.inject_message(html,
-                        '<div class="alert error">Credenciales incorrectas. Inténtalo de nuevo.</div>',
-                            'login')
-                    return html        
+                    logger.warning("❌ HotspotServer: Login fallido: %s desde %s", username, client_ip,
+                                   extra={'event': 'login_failed', 'client_ip': client_ip, 'username': username})
+                    return self.render_portal(login_message=LOGIN_ERROR)
         
-        return self.serve_html('portal.html')
-    def inject_message(self, html, message, target):
-
-        if target == 'login':
-            # Reemplazar el contenido de login-messages
-            pattern = r'<div id="login-messages" class="messages-container">.*?</div>'
-            replacement = f'<div id="login-messages" class="messages-container">{message}</div>'
-            return re.sub(pattern, replacement, html, flags=re.DOTALL)
-        elif target == 'register':
-            # Reemplazar el contenido de register-messages
-            pattern = r'<div id="register-messages" class="messages-container">.*?</div>'
-            replacement = f'<div id="register-messages" class="messages-container">{message}</div>'
-            html = re.sub(pattern, replacement, html, flags=re.DOTALL)
-            # También necesitamos cambiar a la pestaña de registro
-            html = self.inject_script(html, "openTab('register');")
-            return html
-        return html
-    
-
-    def inject_script(self, html, script_code):
-        script = f"""
-        <script>
-            document.addEventListener('DOMContentLoaded', function() {{
-                {script_code}
-            }});
-        </script>
-        """
-        return html.replace('</body>', script + '</body>')
+        return self.render_portal()
     
-    
-
-    def serve_html(self, filename):
-        """Sirve archivos HTML"""
+    def render_portal(self, login_message=b'', register_message=b''):
+        """Renderiza portal.html con los mensajes indicados"""
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                return f.read()
-        except:
-            return """
-            <!DOCTYPE html>
-            <html>
-            <head><title>Error</title></head>
-            <body>
-                <h1>Portal de Acceso Hotspot</h1>
-                <p>Error cargando la página</p>
-            </body>
-            </html>
-            """
-    
-    def message_success(self, msg):
-        return f'<div class="alert success">{msg}</div>'
-    
-    def message_error(self, msg):
-        return f'<div class="alert error">{msg}</div>'
+            template = self.templates.get('portal.html')
+        except Exception as e:
+            logger.error("❌ Error cargando portal.html: %s", e)
+            return ERROR_PAGE
+        # Tras un mensaje de registro se abre directamente esa pestaña
+        script = OPEN_REGISTER_TAB if register_message else b''
+        with TRACER.span('render.portal'):
+            return template.render(login_message=login_message, register_message=register_message, script=script)
     
     def success_page(self, client_ip):
         """Genera página de éxito """
@@ -250,219 +471,207 @@ Content-Length: {len(response_body)}
         else:
             time_remaining = "30:00"
         
-        return f"""
-        <!DOCTYPE html>
-        <html lang="es">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>✅ Acceso Concedido - MiPortalCaptivo</title>
-            <link rel="stylesheet" href="/styles.css">
-            <meta http-equiv="refresh" content="30;url=/status">
-            <style>
-                .success-container {{
-                    max-width: 400px;
-                    margin: 0 auto;
-                }}
-                
-                .success-icon-large {{
-                    font-size: 64px;
-                    text-align: center;
-                    margin: 20px 0;
-                    animation: pulse 2s infinite;
-                }}
-                
-                @keyframes pulse {{
-                    0% {{ transform: scale(1); }}
-                    50% {{ transform: scale(1.1); }}
-                    100% {{ transform: scale(1); }}
-                }}
-                
-                .status-card {{
-                    background: #f8f9fa;
-                    border-radius: 15px;
-                    padding: 20px;
-                    margin: 20px 0;
-                    box-shadow: 0 5px 15px rgba(0,0,0,0.05);
-                }}
-                
-                .status-item {{
-                    display: flex;
-                    justify-content: space-between;
-                    align-items: center;
-                    padding: 10px 0;
-                    border-bottom: 1px solid #e1e5e9;
-                }}
-                
-                .status-item:last-child {{
-                    border-bottom: none;
-                }}
-                
-                .status-label {{
-                    font-weight: 600;
-                    color: #333;
-                }}
-                
-                .status-value {{
-                    font-weight: 700;
-                    color: #667eea;
-                    font-size: 16px;
-                }}
-                
-                .time-remaining {{
-                    font-size: 28px;
-                    font-weight: 700;
-                    color: #28a745;
-                    text-align: center;
-                    margin: 10px 0;
-                }}
-                
-                .time-label {{
-                    font-size: 14px;
-                    color: #666;
-                    text-align: center;
-                    margin-bottom: 20px;
-                }}
-                
-                .connection-status {{
-                    display: inline-flex;
-                    align-items: center;
-                    gap: 8px;
-                }}
-                
-                .status-dot {{
-                    width: 10px;
-                    height: 10px;
-                    background-color: #28a745;
-                    border-radius: 50%;
-                    animation: blink 2s infinite;
-                }}
-                
-                @keyframes blink {{
-                    0%, 100% {{ opacity: 1; }}
-                    50% {{ opacity: 0.5; }}
-                }}
-                
-                .btn-logout {{
-                    width: 100%;
-                    margin-top: 20px;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="container success-container">
-                <h1>🌐 Portal Cautivo</h1>
-                
-                <div class="welcome-message">
-                    <div class="success-icon-large">✅</div>
-                    <h3>¡Acceso Concedido!</h3>
-                    <p>Ya tienes conexión a internet. Tu sesión está activa.</p>
-                </div>
-                
-                <div class="time-remaining">{time_remaining}</div>
-                <div class="time-label">minutos restantes</div>
-                
-                <div class="status-card">
-                    <div class="status-item">
-                        <span class="status-label">Dispositivo:</span>
-                        <span class="status-value">{client_ip}</span>
-                    </div>
-                    <div class="status-item">
-                        <span class="status-label">Estado:</span>
-                        <span class="connection-status">
-                            <span class="status-dot"></span>
-                            <span class="status-value">CONECTADO</span>
-                        </span>
-                    </div>
-                    <div class="status-item">
-                        <span class="status-label">Sesión activa:</span>
-                        <span class="status-value">✓</span>
-                    </div>
-                </div>
-                
-                <a href="/logout" class="btn btn-logout" style="background: linear-gradient(135deg, #dc3545 0%, #c82333 100%);">
-                    🚪 Cerrar sesión
-                </a>
-                
-                <div class="network-info">
-                    <p style="color: #666; font-size: 12px; margin-top: 20px; text-align: center;">
-                        ⏰ La sesión se renovará automáticamente.<br>
-                        ℹ️ Esta página se actualizará cada 30 segundos.
-                    </p>
-                </div>
-            </div>
-            
-            <script>
-                // Actualizar el contador de tiempo cada minuto
-                function updateTimer() {{
-                    let timerElement = document.querySelector('.time-remaining');
-                    let timeParts = timerElement.textContent.split(':');
-                    let minutes = parseInt(timeParts[0]);
-                    let seconds = parseInt(timeParts[1]);
-                    
-                    if (seconds > 0) {{
-                        seconds--;
-                    }} else {{
-                        if (minutes > 0) {{
-                            minutes--;
-                            seconds = 59;
-                        }}
-                    }}
-                    
-                    // Si se acaba el tiempo, recargar para verificar estado
-                    if (minutes === 0 && seconds === 0) {{
-                        window.location.reload();
-                    }}
-                    
-                    timerElement.textContent = minutes.toString().padStart(2, '0') + ':' + seconds.toString().padStart(2, '0');
-                }}
-                
-                // Iniciar el contador si hay tiempo válido
-                document.addEventListener('DOMContentLoaded', function() {{
-                    let timerElement = document.querySelector('.time-remaining');
-                    let timeText = timerElement.textContent;
-                    
-                    if (timeText.includes(':')) {{
-                        setInterval(updateTimer, 1000);
-                    }}
-                    
-                    // Mostrar notificación de conexión exitosa
-                    setTimeout(() => {{
-                        console.log('✅ Conexión establecida correctamente');
-                    }}, 1000);
-                }});
-            </script>
-        </body>
-        </html>
-        """
+        try:
+            template = self.templates.get('success.html')
+        except Exception as e:
+            logger.error("❌ Error cargando success.html: %s", e)
+            return ERROR_PAGE
+        with TRACER.span('render.success'):
+            return template.render(time_remaining=time_remaining, client_ip=client_ip)
+    
+    def worker_loop(self):
+        """Hilo del pool: atiende conexiones de la cola de aceptación"""
+        while True:
+            conn, addr, state = self.accept_queue.get()
+            with self.pool_lock:
+                self.busy_workers += 1
+            ACTIVE_CONNECTIONS.inc()
+            try:
+                self.handle_request(conn, addr, state)
+            finally:
+                ACTIVE_CONNECTIONS.dec()
+                with self.pool_lock:
+                    self.busy_workers -= 1
+    
+    def shed_connection(self, conn):
+        """Rechaza una conexión con el 503 precalculado sin bloquear el accept"""
+        self.shed_count += 1
+        try:
+            conn.setblocking(False)
+            conn.send(SHED_RESPONSE)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+    
+    def get_pool_stats(self):
+        """Obtiene el estado del pool de hilos y los contadores de descarte"""
+        with self.pool_lock:
+            busy = self.busy_workers
+        return {
+            'pool_size': self.pool_size,
+            'queue_depth': self.queue_depth,
+            'queued': self.accept_queue.qsize(),
+            'busy_workers': busy,
+            'accepted': self.accepted_count,
+            'shed': self.shed_count
+        }
+    
     def start(self):
         """Inicia el servidor"""
-        print("🚀 SERVIDOR HOTSPOT INICIADO")
-        print("============================")
-        print(f"📡 Hotspot: MiPortalCautivo")
-        print(f"🔗 IP: {self.host}:{self.port}")
-        print(f"⏰ Timeout de sesión: {self.session_manager.session_timeout // 60} minutos")
-        print(f"🔒 Detección de suplantación: ACTIVADA")
-        print("👂 Esperando conexiones...")
+        # Un único registro (una línea JSON) en lugar del cartel de varias líneas
+        # Con sesiones compartidas el firewall lo aplica el supervisor pre-fork, no este proceso
+        firewall = self.firewall_manager.backend.name if self.firewall_manager else 'supervisor'
+        logger.info("🚀 SERVIDOR HOTSPOT INICIADO: MiPortalCautivo en %s:%d, sesiones de %d minutos, "
+                    "detección de suplantación ACTIVADA, firewall %s",
+                    self.host, self.port, self.session_manager.session_timeout // 60, firewall,
+                    extra={'event': 'start', 'mode': self.mode, 'port': self.port})
+        
+        try:
+            self.serve()
+        finally:
+            self.shutdown()
+    
+    def shutdown(self):
+        """Escribe en la BD los cambios de sesión pendientes antes de salir"""
+        logger.info("🛑 HotspotServer: Deteniendo servidor...")
+        self.session_writer.stop()
+        TRACER.close()
+        portal_logging.stop_logging()
+    
+    def serve(self):
+        """Prepara el estado y atiende conexiones hasta que se interrumpa"""
+        if not self.shared_sessions:
+            # Limpiar sesiones expiradas al inicio
+            self.auth_manager.clean_expired_sessions()
+            
+            # Restaurar las sesiones vigentes antes de aceptar conexiones
+            self.session_manager.restore_sessions()
+        
+        # Mantener la tabla de vecinos fresca en segundo plano
+        self.session_manager.neighbor_table.start()
         
-        # Limpiar sesiones expiradas al inicio
-        self.auth_manager.clean_expired_sessions()
+        if self.mode == 'event-loop':
+            from event_loop_server import EventLoopServer
+            logger.info("🔁 Modo event-loop (%d hilos para trabajo bloqueante, %d para login/registro)",
+                        self.workers, self.auth_workers)
+            EventLoopServer(self, max_workers=self.workers, auth_workers=self.auth_workers).run()
+            return
         
         try:
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
                 s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                if self.reuse_port:
+                    # El kernel reparte las conexiones entre los procesos que escuchan en el puerto
+                    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
                 s.bind((self.host, self.port))
-                s.listen(5)
+                s.listen(self.backlog)
+                
+                logger.info("🧵 Pool de %d hilos, cola de %d conexiones", self.pool_size, self.queue_depth)
+                for i in range(self.pool_size):
+                    worker = threading.Thread(target=self.worker_loop, name=f"hotspot-worker-{i}")
+                    worker.daemon = True
+                    worker.start()
+                self.idle_watcher.start()
                 
                 while True:
                     conn, addr = s.accept()
-                    thread = threading.Thread(target=self.handle_request, args=(conn, addr))
-                    thread.daemon = True
-                    thread.start()
+                    try:
+                        self.accept_queue.put_nowait((conn, addr, None))
+                        self.accepted_count += 1
+                    except queue.Full:
+                        self.shed_connection(conn)
                     
         except Exception as e:
-            print(f"❌ ERROR: {e}")
+            logger.error("❌ ERROR: %s", e)
 
 if __name__ == "__main__":
-    server = HotspotServer()
-    server.start()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Servidor del portal cautivo")
+    parser.add_argument('--mode', choices=['threaded', 'event-loop'], default='threaded',
+                        help="Modelo de concurrencia del servidor")
+    parser.add_argument('--backlog', type=int, default=128,
+                        help="Tamaño de la cola de conexiones pendientes (listen)")
+    parser.add_argument('--workers', type=int, default=8,
+                        help="Hilos para SQLite y renderizado en modo event-loop")
+    parser.add_argument('--auth-workers', type=int, default=4,
+                        help="Hilos para los POST de login/registro (scrypt) en modo event-loop")
+    parser.add_argument('--pool-size', type=int, default=32,
+                        help="Hilos fijos que atienden conexiones en modo threaded")
+    parser.add_argument('--queue-depth', type=int, default=256,
+                        help="Conexiones en espera antes de responder 503 en modo threaded")
+    parser.add_argument('--db-busy-timeout', type=float, default=5.0,
+                        help="Segundos que SQLite espera a un lock de escritura")
+    parser.add_argument('--hash-workers', type=int, default=2,
+                        help="Procesos dedicados a scrypt (0 = en el propio hilo)")
+    parser.add_argument('--session-timeout', type=float, default=1800,
+                        help="Segundos que dura cada sesión desde el login")
+    parser.add_argument('--mac-check-ttl', type=float, default=10,
+                        help="Segundos entre verificaciones completas de MAC por sesión")
+    parser.add_argument('--firewall-backend', choices=['script', 'ipset'], default='script',
+                        help="script: reglas por IP con unlock.sh/block.sh; ipset: set de clientes autorizados")
+    parser.add_argument('--ipset-name', default='portal_allowed',
+                        help="Nombre del set creado por config.sh")
+    parser.add_argument('--ipset-mac', action='store_true',
+                        help="El set es hash:ip,mac y autoriza la pareja IP+MAC")
+    parser.add_argument('--db-flush-interval', type=float, default=50,
+                        help="Milisegundos máximos que un cambio de sesión espera a escribirse (0 = síncrono)")
+    parser.add_argument('--db-flush-ops', type=int, default=256,
+                        help="Cambios de sesión acumulados que fuerzan la escritura del lote")
+    parser.add_argument('--login-rate', type=float, default=1.0,
+                        help="Intentos de login/registro por segundo y por IP")
+    parser.add_argument('--login-burst', type=int, default=10,
+                        help="Intentos seguidos permitidos por IP antes de responder 429")
+    parser.add_argument('--user-login-rate', type=float, default=0.2,
+                        help="Intentos de login por segundo contra un mismo username")
+    parser.add_argument('--user-login-burst', type=int, default=5,
+                        help="Intentos seguidos permitidos por username antes de responder 429")
+    parser.add_argument('--metrics-allow', default='',
+                        help="IPs (separadas por comas) que pueden leer /metrics además del propio gateway")
+    parser.add_argument('--trace-sample-rate', type=float, default=0.0,
+                        help="Fracción de solicitudes trazadas por fase (0 = desactivado, 0.01 = 1%%)")
+    parser.add_argument('--trace-file', default='traces.jsonl',
+                        help="Fichero JSONL de trazas (rota a los 10 MB, guarda 3 copias)")
+    parser.add_argument('--profile-dir', default='.',
+                        help="Directorio donde SIGUSR1 o /debug/profile dejan los perfiles")
+    parser.add_argument('--profile-seconds', type=float, default=10.0,
+                        help="Duración de la ventana de perfilado")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="Procesos worker con SO_REUSEPORT y sesiones compartidas en SQLite (1 = un solo proceso)")
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO',
+                        help="Nivel de log (DEBUG muestra cada paso de cada solicitud)")
+    parser.add_argument('--log-format', choices=['json', 'text'], default='json',
+                        help="Líneas JSON para journald/agregadores o texto para la consola")
+    args = parser.parse_args()
+    
+    # Los logs se escriben desde un hilo aparte: un stdout lento no frena las solicitudes
+    portal_logging.configure_logging(args.log_level, args.log_format)
+    
+    # SIGTERM sale por el mismo camino que Ctrl+C: los cambios pendientes se escriben
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    options = dict(backlog=args.backlog, mode=args.mode, workers=args.workers, auth_workers=args.auth_workers,
+                   pool_size=args.pool_size, queue_depth=args.queue_depth,
+                   db_busy_timeout=args.db_busy_timeout, hash_workers=args.hash_workers,
+                   session_timeout=args.session_timeout,
+                   mac_check_ttl=args.mac_check_ttl, firewall_backend=args.firewall_backend,
+                   ipset_name=args.ipset_name, ipset_mac=args.ipset_mac,
+                   db_flush_interval=args.db_flush_interval / 1000,
+                   db_flush_ops=args.db_flush_ops, login_rate=args.login_rate,
+                   login_burst=args.login_burst, user_login_rate=args.user_login_rate,
+                   user_login_burst=args.user_login_burst,
+                   metrics_allow=[ip.strip() for ip in args.metrics_allow.split(',') if ip.strip()],
+                   trace_sample_rate=args.trace_sample_rate, trace_file=args.trace_file,
+                   profile_dir=args.profile_dir, profile_seconds=args.profile_seconds)
+    
+    if args.processes > 1:
+        # Pre-fork: N workers en el mismo puerto; este proceso es el único que toca firewall y expiraciones
+        from prefork import PreforkSupervisor
+        PreforkSupervisor(options, args.processes, log_level=args.log_level,
+                          log_format=args.log_format).run()
+        sys.exit(0)
+    
+    server = HotspotServer(**options)
+    
+    # kill -USR1 <pid> perfila el servidor en marcha sin reiniciarlo
+    signal.signal(signal.SIGUSR1, lambda signum, frame: server.start_profile())
+    server.start()
@@ -1,202 +1,410 @@
+import itertools
+import logging
 import threading
 import time
+from collections import namedtuple
 from datetime import datetime, timedelta
-import subprocess
 
-class NetworkSessionManager:
-    """Maneja sesiones de usuarios con control de tiempo y suplantación"""
-    
-    def __init__(self, auth_manager, firewall_manager = None, session_timeout=1800):
-        self.auth_manager = auth_manager
-        self.firewall_manager = firewall_manager
-        self.session_timeout = session_timeout
-        self.active_sessions = {}  # {ip: {'expiry': timestamp, 'mac': mac, 'username': username}}
-        self.session_lock = threading.RLock()
-    
+from neighbor_table import NeighborTable, EMPTY_MAC
+from expiry_scheduler import ExpiryScheduler
+from firewall_queue import FirewallQueue
+from session_writer import SessionWriter
+
+logger = logging.getLogger('portal.session_manager')
+
+# Instantánea inmutable de una sesión: los lectores nunca ven un estado a medias.
+# session_id identifica la sesión aunque la instantánea se reemplace (MAC, verified_at, firewall)
+Session = namedtuple('Session', ['session_id', 'username', 'mac', 'expiry', 'verified_at', 'firewall'])
+
+def normalize_mac(mac):
+    """Normaliza MAC a formato estándar (mayúsculas, separador ':')"""
+    if not mac:
+        return EMPTY_MAC
+    normalized = mac.strip().upper().replace('-', ':')
+    return normalized if normalized else EMPTY_MAC
+
+class SessionManagerBase:
+    """Lo común a los gestores de sesiones: MAC normalizada, tabla de vecinos y contadores por hilo"""
+
+    def __init__(self, neighbor_table=None):
+        self.neighbor_table = neighbor_table or NeighborTable()
+        # Contadores por hilo: el camino rápido no comparte ningún lock entre clientes
+        self.stats_local = threading.local()
+        self.stats_lock = threading.Lock()
+        self.thread_stats = []
+
     def _normalize_mac(self, mac: str) -> str:
         """Normaliza MAC a formato estándar"""
-        if not mac:
-            return "00:00:00:00:00:00"
-        normalized = mac.strip().upper().replace('-', ':')
-        return normalized if normalized else "00:00:00:00:00:00"
-    
+        return normalize_mac(mac)
+
     def get_client_mac(self, client_ip):
-        """Obtiene MAC del cliente"""
+        """Obtiene MAC del cliente desde la tabla de vecinos en memoria"""
         try:
-            result = subprocess.run(
-                ['ip', 'neigh', 'show', client_ip], 
-                capture_output=True, 
-                text=True, 
-                timeout=3
-            )
-            if result.returncode == 0 and result.stdout:
-                line = result.stdout.strip()
-                parts = line.split()
-                if "lladdr" in parts:
-                    idx = parts.index("lladdr")
-                    return parts[idx + 1].upper()
+            mac = self.neighbor_table.lookup(client_ip)
+            if mac:
+                return mac
         except Exception as e:
-            print(f"⚠️ NetworkSessionManager Error obteniendo MAC: {e}")
-        return "00:00:00:00:00:00"
-    
+            logger.warning("⚠️ SessionManager Error obteniendo MAC: %s", e)
+        return EMPTY_MAC
+
+    def _count(self, name):
+        stats = getattr(self.stats_local, 'stats', None)
+        if stats is None:
+            stats = self.stats_local.stats = {'fast_path_hits': 0, 'full_checks': 0}
+            with self.stats_lock:
+                self.thread_stats.append(stats)
+        stats[name] += 1
+
+    def get_verification_stats(self):
+        """Obtiene cuántas verificaciones usaron el camino rápido y cuántas fueron completas"""
+        totals = {'fast_path_hits': 0, 'full_checks': 0}
+        with self.stats_lock:
+            for stats in self.thread_stats:
+                for name in totals:
+                    totals[name] += stats[name]
+        return totals
+
+class NetworkSessionManager(SessionManagerBase):
+    """Maneja sesiones de usuarios con control de tiempo y suplantación"""
+
+    def __init__(self, auth_manager, firewall_manager = None, session_timeout=1800, neighbor_table=None,
+                 mac_check_ttl=10, firewall_queue=None, lock_stripes=64, session_writer=None):
+        self.auth_manager = auth_manager
+        # Los cambios de sesión se agrupan y se confirman en lote: no hay un commit por solicitud
+        self.session_writer = session_writer or SessionWriter(auth_manager)
+        self.session_writer.start()
+        self.firewall_manager = firewall_manager
+        # Las operaciones de firewall se aplican en segundo plano: el HTTP nunca espera a iptables
+        self.firewall_queue = firewall_queue
+        if self.firewall_queue is None and firewall_manager is not None:
+            self.firewall_queue = FirewallQueue(firewall_manager)
+        if self.firewall_queue is not None:
+            self.firewall_queue.start()
+        # Con parejas IP+MAC (ipset hash:ip,mac) el desbloqueo espera a conocer la MAC del cliente
+        manager = firewall_manager or getattr(self.firewall_queue, 'firewall_manager', None)
+        self.firewall_needs_mac = bool(getattr(manager, 'requires_mac', False))
+        super().__init__(neighbor_table)
+        self.neighbor_table.add_listener(self.on_neighbor_change)
+        self.session_timeout = session_timeout
+        self.mac_check_ttl = mac_check_ttl  # Segundos que se confía en la última verificación MAC
+        # {ip: Session}. Las lecturas no toman ningún lock: cada escritura publica una instantánea
+        # nueva con una sola asignación, serializada sólo con las demás escrituras de la misma IP
+        self.active_sessions = {}
+        self.session_locks = [threading.Lock() for _ in range(lock_stripes)]
+        self.session_ids = itertools.count(1)
+        # Un único hilo para todas las expiraciones en lugar de un Timer por sesión
+        self.expiry_scheduler = ExpiryScheduler(self.expire_sessions)
+        self.expiry_scheduler.start()
+
+    def _lock_for(self, client_ip):
+        """Lock de la franja a la que pertenece una IP"""
+        return self.session_locks[hash(client_ip) % len(self.session_locks)]
+
+    def _new_session(self, username, mac, expiry, verified_at):
+        # Sin cola de firewall no queda nada pendiente de aplicar
+        firewall = 'pending' if self.firewall_queue is not None else 'applied'
+        return Session(next(self.session_ids), username, mac, expiry, verified_at, firewall)
+
+    def _insert(self, client_ip, session, only_if_absent=False, started=None):
+        """Publica una sesión nueva, encola el desbloqueo y programa su expiración"""
+        with self._lock_for(client_ip):
+            if only_if_absent and client_ip in self.active_sessions:
+                return False
+            self.active_sessions[client_ip] = session
+            # Encolar dentro del lock conserva el orden de allow/deny y de escrituras de una misma IP.
+            # Sin MAC la sesión queda 'pending' hasta que verify_mac_integrity la aprenda
+            if not self._waits_for_mac(session.mac):
+                self.request_firewall('allow', client_ip, session.mac, session.session_id)
+            if started is not None:
+                self.session_writer.save_session(
+                    client_ip, session.username, session.mac, started.isoformat(),
+                    datetime.fromtimestamp(session.expiry).isoformat(), 1, defer=True
+                )
+            self.expiry_scheduler.schedule(client_ip, session.expiry)
+        # Con escritura síncrona el commit de SQLite se hace ya fuera del lock
+        self.session_writer.commit(client_ip)
+        return True
+
+    def _waits_for_mac(self, mac):
+        """Indica si el desbloqueo de una sesión con esta MAC debe esperar a conocerla"""
+        return self.firewall_needs_mac and mac == EMPTY_MAC
+
+    def _learn_mac(self, client_ip, session, mac):
+        """Guarda la MAC descubierta de una sesión sin MAC y, si esperaba por ella, la desbloquea"""
+        if self._update(client_ip, session.session_id, mac=mac) is None:
+            return
+        self.session_writer.update_mac(client_ip, mac)
+        if self._waits_for_mac(session.mac):
+            logger.info("🔓 NetworkSessionManager: MAC %s aprendida para %s, desbloqueando", mac, client_ip)
+            self.request_firewall('allow', client_ip, mac, session.session_id)
+
+    def _update(self, client_ip, session_id, **changes):
+        """Reemplaza la instantánea de una sesión si sigue siendo la misma; devuelve la nueva o None"""
+        with self._lock_for(client_ip):
+            session = self.active_sessions.get(client_ip)
+            if session is None or session.session_id != session_id:
+                return None
+            session = session._replace(**changes)
+            self.active_sessions[client_ip] = session
+            return session
+
+    def _remove(self, client_ip, session_id=None, expired_by=None):
+        """Retira una sesión y encola su bloqueo; devuelve la sesión retirada o None"""
+        with self._lock_for(client_ip):
+            session = self.active_sessions.get(client_ip)
+            if session is None:
+                return None
+            if session_id is not None and session.session_id != session_id:
+                return None
+            if expired_by is not None and session.expiry > expired_by:
+                return None  # Renovada después de programarse la expiración
+            del self.active_sessions[client_ip]
+            self.request_firewall('deny', client_ip)
+            self.session_writer.set_liberated(client_ip, 0, defer=True)
+            self.expiry_scheduler.cancel(client_ip)
+        self.session_writer.commit(client_ip)
+        return session
+
+    def on_neighbor_change(self, client_ip, old_mac, new_mac):
+        """La MAC de una IP cambió: obliga a una verificación completa en la próxima solicitud"""
+        session = self.active_sessions.get(client_ip)
+        if session is not None:
+            self._update(client_ip, session.session_id, verified_at=0.0)
+
+    def request_firewall(self, action, client_ip, mac=None, session_id=None):
+        """Encola una operación de firewall sin esperar a que se aplique"""
+        if self.firewall_queue is None:
+            return
+
+        callback = None
+        if session_id is not None:
+            def callback(ip, applied_action, status):
+                self.on_firewall_done(session_id, ip, status)
+        self.firewall_queue.submit(action, client_ip, mac, callback)
+
+    def on_firewall_done(self, session_id, client_ip, status):
+        """Registra el resultado del desbloqueo de una sesión"""
+        if status == 'superseded':
+            return
+        if self._update(client_ip, session_id, firewall=status) is None:
+            return  # La sesión ya terminó o fue reemplazada
+        if status == 'failed':
+            logger.error("❌ NetworkSessionManager: Error desbloqueando %s en el firewall", client_ip)
+            self.end_session(client_ip, "firewall", session_id)
+
     def check_session_expired(self, client_ip):
         """Verifica si una sesión ha expirado"""
-        with self.session_lock:
-            if client_ip in self.active_sessions:
-                expiry_time = self.active_sessions[client_ip]['expiry']
-                if time.time() > expiry_time:
-                    print(f"⏰ NetworkSessionManager: Sesión expirada para {client_ip}")
-                    return True
-            return False
-    
+        session = self.active_sessions.get(client_ip)
+        if session is not None and time.time() > session.expiry:
+            logger.debug("⏰ NetworkSessionManager: Sesión expirada para %s", client_ip)
+            return True
+        return False
+
     def verify_mac_integrity(self, client_ip, username):
         """Verifica integridad de la dirección MAC"""
         try:
+            # Tabla de vecinos y BD se consultan sin ningún lock tomado
             current_mac = self.get_client_mac(client_ip)
             normalized_current_mac = self._normalize_mac(current_mac)
-            
-            with self.session_lock:
-                if client_ip in self.active_sessions:
-                    stored_mac = self.active_sessions[client_ip].get('mac', '00:00:00:00:00:00')
-                    
-                    if stored_mac == "00:00:00:00:00:00" and normalized_current_mac != "00:00:00:00:00:00":
-                        self.active_sessions[client_ip]['mac'] = normalized_current_mac
-                        self.auth_manager.update_mac_address(client_ip, normalized_current_mac)
-                        return True
-                    
-                    if (stored_mac != "00:00:00:00:00:00" and 
-                        normalized_current_mac != "00:00:00:00:00:00" and 
-                        stored_mac != normalized_current_mac):
-                        print(f"🚨 NetworkSessionManager: Posible suplantación en {client_ip}")
-                        print(f"   Almacenada: {stored_mac}")
-                        print(f"   Actual: {normalized_current_mac}")
-                        self.end_session(client_ip,"suplantacion")
-                        return False
-                
-                session_data = self.auth_manager.get_session_data(client_ip)
-                if session_data:
-                    db_mac = self._normalize_mac(session_data[2])
-                    
-                    if client_ip in self.active_sessions:
-                        self.active_sessions[client_ip]['mac'] = db_mac
-                    
-                    if (db_mac != "00:00:00:00:00:00" and 
-                        normalized_current_mac != "00:00:00:00:00:00" and 
-                        db_mac != normalized_current_mac):
-                        print(f"🚨 SessionManager: Suplantación en BD para {client_ip}")
-                        return False
-            
+
+            session = self.active_sessions.get(client_ip)
+            if session is not None:
+                stored_mac = session.mac
+
+                if stored_mac == EMPTY_MAC and normalized_current_mac != EMPTY_MAC:
+                    self._learn_mac(client_ip, session, normalized_current_mac)
+                    return True
+
+                if (stored_mac != EMPTY_MAC and
+                    normalized_current_mac != EMPTY_MAC and
+                    stored_mac != normalized_current_mac):
+                    logger.warning("🚨 NetworkSessionManager: Posible suplantación en %s (almacenada %s, actual %s)",
+                                   client_ip, stored_mac, normalized_current_mac,
+                                   extra={'event': 'spoofing', 'client_ip': client_ip,
+                                          'stored_mac': stored_mac, 'current_mac': normalized_current_mac})
+                    self.end_session(client_ip, "suplantacion", session.session_id)
+                    return False
+
+            self.session_writer.wait_for(client_ip)
+            session_data = self.auth_manager.get_session_data(client_ip)
+            if session_data:
+                db_mac = self._normalize_mac(session_data[2])
+
+                if session is not None and db_mac != session.mac:
+                    if session.mac == EMPTY_MAC:
+                        self._learn_mac(client_ip, session, db_mac)
+                    else:
+                        self._update(client_ip, session.session_id, mac=db_mac)
+
+                if (db_mac != EMPTY_MAC and
+                    normalized_current_mac != EMPTY_MAC and
+                    db_mac != normalized_current_mac):
+                    logger.warning("🚨 SessionManager: Suplantación en BD para %s", client_ip,
+                                   extra={'event': 'spoofing', 'client_ip': client_ip,
+                                          'stored_mac': db_mac, 'current_mac': normalized_current_mac})
+                    return False
+
             return True
-            
+
         except Exception as e:
-            print(f"❌ SessionManager Error en verify_mac_integrity: {e}")
+            logger.error("❌ SessionManager Error en verify_mac_integrity: %s", e)
             return True
-    
+
     def create_session(self, client_ip, username, mac=None):
         """Crea una nueva sesión para el usuario"""
-        with self.session_lock:
-            normalized_mac = self._normalize_mac(mac) if mac else "00:00:00:00:00:00"
-            expiry_time = time.time() + self.session_timeout
-            
-            self.active_sessions[client_ip] = {
-                'expiry': expiry_time,
-                'mac': normalized_mac,
-                'username': username
-            }
-            
-            now = datetime.now()
-            expire = now + timedelta(seconds=self.session_timeout)
-            
-            self.auth_manager.update_session_data(
-                client_ip, username, normalized_mac,
-                now.isoformat(), expire.isoformat(), 1
-            )
-            
-            print(f"✅ NetworkSessionManager: Sesión creada para {username} ({client_ip})")
-            print(f"   MAC: {normalized_mac}")
-            print(f"   Expira: {expire.strftime('%H:%M:%S')}")
-            
-            # Programar expiración con bloqueo de firewall
-            def _expire_and_block():
-                self.end_session(client_ip, "timeout")
-            
-            timer = threading.Timer(self.session_timeout, _expire_and_block)
-            timer.daemon = True
-            timer.start()
-            return True
-    
-    def end_session(self, client_ip, reason="timeout"):
-        """Termina una sesión"""
-        with self.session_lock:
-            if client_ip in self.active_sessions:
-                username = self.active_sessions[client_ip].get('username', 'Desconocido')
-                print(f"⏰ NetworkSessionManager: Terminando sesión {username} ({client_ip}) - Razón: {reason}")
-                
-                # Bloquear en firewall si está disponible
-                if self.firewall_manager:
-                    success = self.firewall_manager.block_client(client_ip)
-                    if not success:
-                        print(f"❌ SessionManager: Error bloqueando en firewall para {client_ip}")
-
-                self.auth_manager.set_liberated(client_ip, 0)
-                del self.active_sessions[client_ip]
-                
-                print(f"✅ NetworkSessionManager: Sesión terminada para {client_ip}")
+        normalized_mac = self._normalize_mac(mac) if mac else EMPTY_MAC
+        now = datetime.now()
+        expire = now + timedelta(seconds=self.session_timeout)
+
+        # verified_at: la MAC se acaba de comprobar en el login
+        session = self._new_session(username, normalized_mac, expire.timestamp(), time.monotonic())
+        # Desbloquear en segundo plano, persistir y programar la expiración (reemplaza la anterior)
+        self._insert(client_ip, session, started=now)
+
+        logger.info("✅ NetworkSessionManager: Sesión creada para %s (%s), MAC %s, expira %s",
+                    username, client_ip, normalized_mac, expire,
+                    extra={'event': 'session_start', 'client_ip': client_ip, 'username': username})
+        return True
+
+    def _finish_session(self, client_ip, session, reason):
+        """Informa del fin de una sesión ya retirada de memoria"""
+        logger.info("⏰ NetworkSessionManager: Sesión terminada para %s (%s) - Razón: %s",
+                    session.username, client_ip, reason,
+                    extra={'event': 'session_end', 'client_ip': client_ip, 'username': session.username,
+                           'reason': reason})
+
+    def end_session(self, client_ip, reason="timeout", session_id=None):
+        """Termina una sesión (sólo si sigue siendo session_id, cuando se indica)"""
+        session = self._remove(client_ip, session_id)
+        if session is None:
+            logger.debug("⚠️  NetworkSessionManager: No hay sesión activa para %s", client_ip)
+            return
+        self._finish_session(client_ip, session, reason)
+
+    def expire_sessions(self, client_ips):
+        """Termina las sesiones que vencieron en el mismo tick del planificador"""
+        now = time.time()
+        for client_ip in client_ips:
+            # Ignorar las que ya terminaron o fueron renovadas entre tanto
+            session = self._remove(client_ip, expired_by=now)
+            if session is not None:
+                self._finish_session(client_ip, session, "timeout")
+
+    def end_sessions(self, client_ips, reason):
+        """Termina varias sesiones (la cola de firewall las bloquea en un único lote)"""
+        for client_ip in client_ips:
+            self.end_session(client_ip, reason)
+
+    def end_all_sessions(self, reason="admin"):
+        """Expulsa a todos los clientes conectados"""
+        self.end_sessions(list(self.active_sessions), reason)
+
+    def restore_sessions(self):
+        """Carga todas las sesiones vigentes de la BD y las vuelve a autorizar en un único lote"""
+        start = time.perf_counter()
+        rows = self.auth_manager.get_live_sessions()
+
+        restored = {}
+        for client_ip, username, session_expire_str, mac in rows:
+            try:
+                expiry_timestamp = datetime.fromisoformat(session_expire_str).timestamp()
+            except (ValueError, TypeError) as e:
+                logger.error("❌ NetworkSessionManager Error parseando fecha: %s", e)
+                continue
+
+            # verified_at 0: verificación completa en la primera solicitud
+            session = Session(next(self.session_ids), username, self._normalize_mac(mac),
+                              expiry_timestamp, 0.0, 'pending')
+            with self._lock_for(client_ip):
+                self.active_sessions[client_ip] = session
+                self.expiry_scheduler.schedule(client_ip, expiry_timestamp)
+            restored[client_ip] = session
+
+        # config.sh vacía iptables al arrancar: reautorizar a todos de una vez
+        results = {}
+        if self.firewall_manager and restored:
+            ops = [('allow', ip, session.mac) for ip, session in restored.items()
+                   if not self._waits_for_mac(session.mac)]
+            results = self.firewall_manager.apply_batch(ops)
+        failed = 0
+        for client_ip, session in restored.items():
+            if self._waits_for_mac(session.mac):
+                continue  # Sigue 'pending': se desbloquea cuando verify_mac_integrity aprenda la MAC
+            if self.firewall_manager is None or results.get(client_ip):
+                self._update(client_ip, session.session_id, firewall='applied')
             else:
-                print(f"⚠️  NetworkSessionManager: No hay sesión activa para {client_ip}")
-    
+                # Igual que on_firewall_done: sin reglas no hay sesión (el cliente vuelve al portal)
+                failed += 1
+                self.end_session(client_ip, "firewall", session.session_id)
+        if failed:
+            logger.error("❌ NetworkSessionManager: Error reautorizando %d sesiones en el firewall", failed)
+
+        elapsed = time.perf_counter() - start
+        logger.info("♻️  NetworkSessionManager: %d sesiones restauradas en %.1f ms (%d fallidas en el firewall)",
+                    len(restored) - failed, elapsed * 1000, failed)
+        return len(restored) - failed, elapsed
+
     def verify_active_session(self, client_ip):
         """Verifica si hay una sesión activa válida"""
-        with self.session_lock:
-            if client_ip in self.active_sessions:
-                if self.check_session_expired(client_ip):
-                    return False
-                
-                username = self.active_sessions[client_ip].get('username', '')
-                if not self.verify_mac_integrity(client_ip, username):
-                    return False
-                
+        # Camino rápido: sesión vigente con la MAC verificada hace menos de mac_check_ttl.
+        # Una sesión que espera su MAC para desbloquearse la busca en cada solicitud
+        session = self.active_sessions.get(client_ip)
+        if session is not None:
+            if (time.time() <= session.expiry and
+                    time.monotonic() - session.verified_at < self.mac_check_ttl and
+                    not self._waits_for_mac(session.mac)):
+                self._count('fast_path_hits')
                 return True
-            
-            # Verificar en BD
-            session_data = self.auth_manager.get_session_data(client_ip)
-            if session_data:
-                username, session_expire_str, mac = session_data
-                
-                try:
-                    expire_time = datetime.fromisoformat(session_expire_str)
-                    if expire_time > datetime.now():
-                        # Restaurar desde BD
-                        expiry_timestamp = time.mktime(expire_time.timetuple())
-                        self.active_sessions[client_ip] = {
-                            'expiry': expiry_timestamp,
-                            'mac': self._normalize_mac(mac),
-                            'username': username
-                        }
-                        
-                        time_remaining = (expire_time - datetime.now()).total_seconds()
-                        if time_remaining > 0:
-                            threading.Timer(time_remaining, self.end_session, args=[client_ip, "timeout"]).start()
-                        
-                        print(f"🔄 NetworkSessionManager: Sesión restaurada para {client_ip}")
-                        return True
-                    else:
-                        self.end_session(client_ip, "timeout")
-                except (ValueError, TypeError) as e:
-                    print(f"❌ NetworkSessionManager Error parseando fecha: {e}")
-            
+
+            if self.check_session_expired(client_ip):
+                return False
+
+            self._count('full_checks')
+            if not self.verify_mac_integrity(client_ip, session.username):
+                return False
+
+            self._update(client_ip, session.session_id, verified_at=time.monotonic())
+            return True
+
+        return self.restore_session(client_ip)
+
+    def restore_session(self, client_ip):
+        """Restaura desde la BD la sesión de una IP que no está en memoria"""
+        # Un cierre aún sin escribir no debe resucitar la sesión
+        self.session_writer.wait_for(client_ip)
+        session_data = self.auth_manager.get_session_data(client_ip)
+        if not session_data:
+            return False
+
+        username, session_expire_str, mac = session_data
+        try:
+            expire_time = datetime.fromisoformat(session_expire_str)
+        except (ValueError, TypeError) as e:
+            logger.error("❌ NetworkSessionManager Error parseando fecha: %s", e)
+            return False
+
+        if expire_time <= datetime.now():
+            self.end_session(client_ip, "timeout")
             return False
-    
+
+        expiry_timestamp = time.mktime(expire_time.timetuple())
+        session = self._new_session(username, self._normalize_mac(mac), expiry_timestamp, 0.0)
+        # Las reglas pudieron perderse al reiniciar: volver a autorizar.
+        # Si otra solicitud la restauró primero se conserva esa
+        if self._insert(client_ip, session, only_if_absent=True):
+            logger.info("🔄 NetworkSessionManager: Sesión restaurada para %s", client_ip)
+        return True
+
     def get_session_info(self, client_ip):
         """Obtiene información de una sesión"""
-        with self.session_lock:
-            if client_ip in self.active_sessions:
-                session = self.active_sessions[client_ip]
-                remaining = max(0, session['expiry'] - time.time())
-                return {
-                    'username': session['username'],
-                    'mac': session['mac'],
-                    'remaining': remaining,
-                    'expiry': session['expiry']
-                }
-            return None
\ No newline at end of file
+        session = self.active_sessions.get(client_ip)
+        if session is None:
+            return None
+        remaining = max(0, session.expiry - time.time())
+        return {
+            'username': session.username,
+            'mac': session.mac,
+            'remaining': remaining,
+            'expiry': session.expiry,
+            'firewall': session.firewall
+        }
@@ -0,0 +1,196 @@
+import threading
+import time
+
+class SessionWriter:
+    """Persistencia diferida de sesiones: agrupa los cambios por IP y los confirma en una sola transacción"""
+
+    def __init__(self, auth_manager, flush_interval=0.05, max_ops=256):
+        self.auth_manager = auth_manager
+        # Ventana máxima de cambios que se pierden si el proceso muere (0 = escritura síncrona)
+        self.flush_interval = flush_interval
+        self.max_ops = max_ops  # Cambios acumulados que adelantan la escritura
+        self.pending = {}  # {ip: [(tipo, {columna: valor})]}, en orden de llegada
+        self.pending_ops = 0
+        self.first_pending_at = 0.0
+        self.in_flight = set()
+        self.flush_requested = False
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.stats = {'submitted': 0, 'coalesced': 0, 'flushes': 0, 'written': 0, 'failed': 0}
+
+    def save_session(self, client_ip, username, mac, session_start, session_expire, liberated=1, defer=False):
+        """Registra una sesión nueva (equivale a AuthManager.update_session_data)"""
+        self._submit(client_ip, 'session', {
+            'username': username,
+            'mac_address': mac,
+            'session_start': session_start,
+            'session_expire': session_expire,
+            'liberated': liberated
+        }, defer)
+
+    def update_mac(self, client_ip, mac, defer=False):
+        """Registra la MAC de una IP"""
+        self._submit(client_ip, 'patch', {'mac_address': mac}, defer)
+
+    def set_liberated(self, client_ip, liberated, defer=False):
+        """Registra el estado de liberación de una IP"""
+        self._submit(client_ip, 'patch', {'liberated': liberated}, defer)
+
+    def _submit(self, client_ip, kind, values, defer=False):
+        # defer: en modo síncrono el cambio sólo se encola (en orden) y lo escribe commit(),
+        # para que quien lo registra bajo un lock no haga el commit de SQLite con el lock tomado
+        if not self.running and not defer:
+            self.auth_manager.apply_session_changes([(client_ip, kind, values)])
+            return
+
+        with self.condition:
+            self.stats['submitted'] += 1
+            if not self.pending:
+                self.first_pending_at = time.monotonic()
+            changes = self.pending.setdefault(client_ip, [])
+            if kind == 'patch' and changes:
+                # Se funde con el cambio anterior de la IP: crear + MAC + cerrar es una sola sentencia
+                changes[-1][1].update(values)
+                self.stats['coalesced'] += 1
+            else:
+                changes.append((kind, dict(values)))
+            self.pending_ops += 1
+            if self.pending_ops >= self.max_ops:
+                self.condition.notify_all()
+
+    def commit(self, client_ip, timeout=5.0):
+        """Modo síncrono: escribe ya los cambios aplazados de una IP (con el hilo en marcha no hace nada)"""
+        if self.running:
+            return True
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            # Otro hilo escribiendo esta IP: esperar a que termine para no adelantar cambios posteriores
+            while client_ip in self.in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+            entries = self.pending.pop(client_ip, None)
+            if not entries:
+                return True
+            # Los parches fundidos cuentan en pending_ops sin añadir entradas: recontar lo que queda
+            self.pending_ops = sum(len(changes) for changes in self.pending.values())
+            self.in_flight.add(client_ip)
+
+        success = False
+        try:
+            success = self.auth_manager.apply_session_changes(
+                [(client_ip, kind, values) for kind, values in entries]
+            )
+        finally:
+            with self.condition:
+                self.stats['flushes'] += 1
+                self.stats['written' if success else 'failed'] += len(entries)
+                self.in_flight.discard(client_ip)
+                self.condition.notify_all()
+        return success
+
+    def wait_for(self, client_ip, timeout=5.0):
+        """Espera a que los cambios de una IP estén en la BD antes de leerla"""
+        if not self.running:
+            return self.commit(client_ip, timeout)
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while client_ip in self.pending or client_ip in self.in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.flush_requested = True
+                self.condition.notify_all()
+                self.condition.wait(remaining)
+        return True
+
+    def flush(self, timeout=5.0):
+        """Escribe ya todo lo pendiente y espera a que termine"""
+        if not self.running:
+            return all([self.commit(client_ip, timeout) for client_ip in list(self.pending)])
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while self.pending or self.in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.flush_requested = True
+                self.condition.notify_all()
+                self.condition.wait(remaining)
+        return True
+
+    def start(self):
+        """Arranca el hilo de escritura (con flush_interval 0 cada cambio se escribe al momento)"""
+        with self.condition:
+            if self.running or self.flush_interval <= 0:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, name='session-writer', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5.0):
+        """Escribe lo pendiente y detiene el hilo"""
+        self.flush(timeout)
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def get_stats(self):
+        """Obtiene contadores de cambios recibidos, agrupados y escritos"""
+        with self.condition:
+            stats = dict(self.stats)
+            stats['pending'] = self.pending_ops
+            return stats
+
+    def _take_batch(self):
+        with self.condition:
+            while self.running and not self.pending:
+                self.condition.wait()
+            # Esperar hasta cumplir la ventana desde el primer cambio, salvo que se llene o se pida
+            while self.running and self.pending_ops < self.max_ops and not self.flush_requested:
+                remaining = self.first_pending_at + self.flush_interval - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            if not self.pending:
+                return None
+
+            batch = self.pending
+            self.pending = {}
+            self.pending_ops = 0
+            self.flush_requested = False
+            self.in_flight = set(batch)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+
+            changes = [(client_ip, kind, values)
+                       for client_ip, entries in batch.items() for kind, values in entries]
+            success = self.auth_manager.apply_session_changes(changes)
+
+            with self.condition:
+                self.stats['flushes'] += 1
+                if success:
+                    self.stats['written'] += len(changes)
+                else:
+                    # Reintentar en el siguiente lote, antes que los cambios llegados después
+                    self.stats['failed'] += len(changes)
+                    for client_ip, entries in batch.items():
+                        newer = self.pending.pop(client_ip, [])
+                        self.pending[client_ip] = entries + newer
+                        self.pending_ops += len(entries)
+                    self.first_pending_at = time.monotonic()
+                self.in_flight = set()
+                self.condition.notify_all()
+
+            if not success:
+                time.sleep(self.flush_interval)
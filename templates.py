@@ -0,0 +1,61 @@
+import html
+import re
+
+SLOT_PATTERN = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+
+# Puntos del portal donde se insertan mensajes y scripts (portal.html no lleva marcadores)
+PORTAL_SLOTS = (
+    ('<div id="login-messages" class="messages-container">', 'login_message', 'after'),
+    ('<div id="register-messages" class="messages-container">', 'register_message', 'after'),
+    ('</body>', 'script', 'before'),
+)
+
+class Template:
+    """Página compilada una sola vez en trozos estáticos (bytes) y huecos con nombre"""
+
+    def __init__(self, text):
+        self.parts = []  # Trozos estáticos ya codificados; los huecos quedan a None
+        self.slots = []  # [(posición en parts, nombre del hueco)]
+        pos = 0
+        for match in SLOT_PATTERN.finditer(text):
+            self.parts.append(text[pos:match.start()].encode())
+            self.slots.append((len(self.parts), match.group(1)))
+            self.parts.append(None)
+            pos = match.end()
+        self.parts.append(text[pos:].encode())
+
+    def render(self, **values):
+        """Une los trozos con los valores: str se escapa, bytes se inserta tal cual"""
+        parts = self.parts.copy()
+        for index, name in self.slots:
+            value = values.get(name, b'')
+            if isinstance(value, str):
+                value = html.escape(value).encode()
+            parts[index] = value
+        return b''.join(parts)
+
+def portal_template(text):
+    """Compila portal.html añadiendo los huecos de mensajes y del script final"""
+    for marker, name, where in PORTAL_SLOTS:
+        slot = '{{' + name + '}}'
+        replacement = marker + slot if where == 'after' else slot + marker
+        text = text.replace(marker, replacement, 1)
+    return Template(text)
+
+class TemplateCache:
+    """Compila las páginas de AssetCache y las recompila si el archivo cambia"""
+
+    def __init__(self, assets, compilers=None):
+        self.assets = assets
+        self.compilers = compilers or {}  # {filename: función texto -> Template}
+        self.compiled = {}  # {filename: (CachedAsset, Template)}
+
+    def get(self, filename):
+        """Obtiene la plantilla compilada de un archivo"""
+        asset = self.assets.get(filename)
+        entry = self.compiled.get(filename)
+        if entry is None or entry[0] is not asset:
+            compiler = self.compilers.get(filename, Template)
+            entry = (asset, compiler(asset.text))
+            self.compiled[filename] = entry
+        return entry[1]
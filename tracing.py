@@ -0,0 +1,185 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger('portal.tracing')
+
+class _NullSpan:
+    """Span de una solicitud no muestreada: no mide nada"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, self.start, time.perf_counter() - self.start)
+        return False
+
+class _Trace:
+    __slots__ = ('name', 'start', 'wall', 'attrs', 'spans')
+
+    def __init__(self, name, start, attrs):
+        self.name = name
+        self.start = start
+        self.wall = time.time() - (time.perf_counter() - start)
+        self.attrs = attrs
+        self.spans = []
+
+    def add(self, name, start, duration):
+        self.spans.append((name, start, duration))
+
+    def to_dict(self, duration):
+        return {
+            'ts': round(self.wall, 6),
+            'trace': self.name,
+            'duration_ms': round(duration * 1000, 3),
+            'thread': threading.current_thread().name,
+            **self.attrs,
+            'spans': [
+                {'name': name, 'offset_ms': round((start - self.start) * 1000, 3),
+                 'duration_ms': round(span_duration * 1000, 3)}
+                for name, start, span_duration in self.spans
+            ]
+        }
+
+class Tracer:
+    """Trazas muestreadas por solicitud: spans por fase escritos como JSONL en un fichero rotativo"""
+
+    def __init__(self):
+        self.sample_rate = 0.0  # Desactivado hasta configure(): span() cuesta una consulta a threading.local
+        self.local = threading.local()
+        self.logger = None
+        self.listener = None
+
+    def configure(self, path='traces.jsonl', sample_rate=0.01, max_bytes=10 * 1024 * 1024, backup_count=3):
+        """Activa el muestreo; la escritura del fichero la hace un hilo aparte (QueueListener)"""
+        self.close()
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                       encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        records = queue.SimpleQueue()
+        self.listener = logging.handlers.QueueListener(records, handler)
+        self.listener.start()
+        self.logger = logging.getLogger('portal.trace')
+        self.logger.propagate = False
+        self.logger.handlers[:] = [logging.handlers.QueueHandler(records)]
+        self.logger.setLevel(logging.INFO)
+        self.sample_rate = sample_rate
+
+    def close(self):
+        """Escribe las trazas pendientes y desactiva el muestreo"""
+        self.sample_rate = 0.0
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def begin(self, name, start=None, **attrs):
+        """Empieza una traza en el hilo actual si sale elegida en el muestreo (start en perf_counter)"""
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            self.local.trace = None
+            return False
+        self.local.trace = _Trace(name, time.perf_counter() if start is None else start, attrs)
+        return True
+
+    def end(self, **attrs):
+        """Cierra la traza del hilo actual y la encola para escribirla"""
+        trace = getattr(self.local, 'trace', None)
+        if trace is None:
+            return
+        self.local.trace = None
+        trace.attrs.update(attrs)
+        logger = self.logger
+        if logger is not None:
+            logger.info(json.dumps(trace.to_dict(time.perf_counter() - trace.start), ensure_ascii=False))
+
+    def span(self, name):
+        """Context manager que mide una fase de la traza actual (no hace nada si no hay traza)"""
+        trace = getattr(self.local, 'trace', None)
+        if trace is None:
+            return NULL_SPAN
+        return _Span(trace, name)
+
+    def add_span(self, name, start, duration):
+        """Añade a la traza actual una fase ya medida (start en perf_counter)"""
+        trace = getattr(self.local, 'trace', None)
+        if trace is not None:
+            trace.add(name, start, duration)
+
+class StackSampler:
+    """Perfil de todos los hilos por muestreo de pilas, sin reiniciar ni instrumentar el servidor"""
+
+    def __init__(self, output_dir='.', interval=0.005):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.running = False
+
+    def start(self, seconds=10.0):
+        """Arranca una ventana de muestreo en segundo plano; devuelve la ruta del perfil o None si ya hay una"""
+        with self.lock:
+            if self.running:
+                return None
+            self.running = True
+        # Con el pid: en modo pre-fork cada worker deja su propio perfil
+        path = os.path.join(self.output_dir, time.strftime(f'profile-%Y%m%d-%H%M%S-{os.getpid()}.folded'))
+        thread = threading.Thread(target=self._run, args=(seconds, path), name='stack-sampler', daemon=True)
+        thread.start()
+        return path
+
+    def _run(self, seconds, path):
+        stacks = Counter()
+        own_id = threading.get_ident()
+        names = {}
+        try:
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for thread in threading.enumerate():
+                    names[thread.ident] = thread.name
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                        frame = frame.f_back
+                    stack.append(names.get(thread_id, str(thread_id)))
+                    stacks[';'.join(reversed(stack))] += 1
+                time.sleep(self.interval)
+
+            # Formato "colapsado": una pila por línea con su número de muestras (flamegraph.pl, speedscope)
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            logger.info("🔬 StackSampler: Perfil de %.0f s guardado en %s (%d muestras)",
+                        seconds, path, sum(stacks.values()))
+        except Exception as e:
+            logger.error("❌ StackSampler Error generando perfil: %s", e)
+        finally:
+            with self.lock:
+                self.running = False
+
+# Trazador del proceso: desactivado hasta que server.py lo configura
+TRACER = Tracer()